@@ -0,0 +1,103 @@
+"""Export a procedural character with option sets that reshape the skin.
+
+Limiting influences, pruning weights and decimating levels of detail all
+leave bone vertex groups without memberships on a large rig.  Every option
+set below is exported with the stand-in ``bpy`` and, when the panda3d
+modules are importable, the egg is loaded into a node tree whose meshes
+must all be skinned:
+
+    python benchmark/check_exports.py --bones 160
+
+The exit status is 1 when an export fails.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'fake'))
+sys.path.insert(0, HERE)
+
+import bpy  # noqa: E402
+import synthetic  # noqa: E402
+from run_benchmark import DEFAULT_MODULE, load_exporter  # noqa: E402
+
+try:
+    from panda3d.core import Filename, NodePath
+    from panda3d.egg import EggData, loadEggData
+except ImportError:
+    EggData = None
+
+OPTION_SETS = [
+    {},
+    {'max_influences': 1},
+    {'max_influences': 2, 'min_weight': 0.2, 'prune_joints': True},
+    {'lod_levels': 4},
+]
+
+
+def load_egg(filepath):
+    egg = EggData()
+    if not egg.read(Filename.fromOsSpecific(filepath)):
+        raise RuntimeError('Panda3D could not parse %s' % filepath)
+    node = loadEggData(egg)
+    if node is None:
+        raise RuntimeError('Panda3D could not load %s' % filepath)
+    # every mesh and level of detail is skinned to the armature
+    for geom_node in NodePath(node).findAllMatches('**/+GeomNode'):
+        for geom in geom_node.node().getGeoms():
+            if geom.getVertexData().getTransformBlendTable() is None:
+                raise RuntimeError('%s is not skinned' % geom_node)
+
+
+def check(module, human, out_dir, options):
+    filepath = os.path.join(out_dir, 'character.egg')
+    worker = module.ExportEggWorker(human, '4', filepath, True, **options)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = worker.produce_egg()
+    if 'FINISHED' not in result:
+        raise RuntimeError('export returned %s' % sorted(result))
+    if EggData is not None:
+        load_egg(filepath)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--module', default=DEFAULT_MODULE,
+                        help='exporter file to check')
+    parser.add_argument('--vertices', type=int, default=3000)
+    parser.add_argument('--bones', type=int, default=160)
+    parser.add_argument('--meshes', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    module = load_exporter(args.module)
+    work_dir = tempfile.mkdtemp(prefix='egg_check_')
+    failures = 0
+    try:
+        bpy.reset()
+        human = synthetic.build_character(
+            vertices=args.vertices, bones=args.bones, meshes=args.meshes,
+            tex_dir=os.path.join(work_dir, 'source_textures'))
+        for index, options in enumerate(OPTION_SETS):
+            out_dir = os.path.join(work_dir, 'out%d' % index)
+            os.mkdir(out_dir)
+            try:
+                check(module, human, out_dir, options)
+                print('ok     %r' % options)
+            except Exception:
+                failures += 1
+                print('FAILED %r' % options)
+                traceback.print_exc()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
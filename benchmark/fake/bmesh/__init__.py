@@ -0,0 +1,100 @@
+"""Minimal stand-in for Blender's ``bmesh`` module.
+
+Only older revisions of the exporter build a BMesh; it is kept so that
+they can be benchmarked against the current one.
+
+``BMVert.link_loops`` is ordered by loop index, which is what Blender
+yields for the simple manifold meshes the benchmark generates.
+"""
+
+from mathutils import Vector
+
+
+class _UVLayerKey(object):
+    pass
+
+
+class _LoopUV(object):
+    def __init__(self, uv):
+        self.uv = uv
+
+
+class BMFace(object):
+    def __init__(self, index, material_index):
+        self.index = index
+        self.material_index = material_index
+
+
+class BMLoop(object):
+    def __init__(self, index, face, uv):
+        self.index = index
+        self.face = face
+        self._uv = uv
+
+    def __getitem__(self, layer):
+        if layer is None:
+            raise KeyError('no UV layer')
+        return _LoopUV(self._uv)
+
+
+class BMVert(object):
+    def __init__(self, index, co):
+        self.index = index
+        self.co = co
+        self.link_loops = []
+
+
+class _Verts(object):
+    def __init__(self):
+        self._verts = []
+
+    def ensure_lookup_table(self):
+        pass
+
+    def __getitem__(self, index):
+        return self._verts[index]
+
+    def __len__(self):
+        return len(self._verts)
+
+    def __iter__(self):
+        return iter(self._verts)
+
+
+class _Layers(object):
+    def __init__(self):
+        self.uv = type('UVLayers', (object,), {'active': None})()
+
+
+class _Loops(object):
+    def __init__(self):
+        self.layers = _Layers()
+
+
+class BMesh(object):
+    def __init__(self):
+        self.verts = _Verts()
+        self.loops = _Loops()
+
+    def from_mesh(self, mesh):
+        co = mesh._co
+        uv = mesh._uv
+        if uv is not None:
+            self.loops.layers.uv.active = _UVLayerKey()
+        verts = [BMVert(i, Vector(c)) for i, c in enumerate(co.tolist())]
+        for p, (start, total, mat) in enumerate(zip(
+                mesh._loop_start.tolist(), mesh._loop_total.tolist(),
+                mesh._poly_material.tolist())):
+            face = BMFace(p, mat)
+            for li in range(start, start + total):
+                v = int(mesh._loop_vertex[li])
+                loop_uv = Vector(uv[li]) if uv is not None else None
+                verts[v].link_loops.append(BMLoop(li, face, loop_uv))
+        self.verts._verts = verts
+
+    def free(self):
+        self.verts._verts = []
+
+
+def new():
+    return BMesh()
@@ -0,0 +1,464 @@
+"""Minimal stand-in for Blender's ``bpy`` module.
+
+Only the surface that ``io_export_egg`` touches is modelled.  Collections
+hand out freshly created per-item proxies on every access, like RNA does,
+so attribute-by-attribute code pays a comparable price to the real thing,
+while ``foreach_get`` copies straight out of NumPy arrays.
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+from mathutils import Color, Matrix, Vector
+
+from . import props, types, utils  # noqa: F401
+
+
+class _Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _fill(seq, values):
+    values = np.asarray(values).ravel()
+    if len(seq) != len(values):
+        raise RuntimeError('foreach_get: sequence size mismatch '
+                           '(%d != %d)' % (len(seq), len(values)))
+    seq[:] = values
+
+
+class _ArrayCollection(object):
+    """Read-only RNA collection over column arrays."""
+
+    def __init__(self, length, factory, arrays):
+        self._length = length
+        self._factory = factory
+        self._arrays = arrays
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self._factory(index)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._factory(index)
+
+    def foreach_get(self, attr, seq):
+        _fill(seq, self._arrays[attr]())
+
+
+class MeshVertex(object):
+    def __init__(self, mesh, index):
+        self._mesh = mesh
+        self.index = index
+
+    @property
+    def co(self):
+        return Vector(self._mesh._co[self.index])
+
+    @property
+    def normal(self):
+        return Vector(self._mesh._normals[self.index])
+
+    @property
+    def groups(self):
+        mesh = self._mesh
+        start, stop = mesh._w_indptr[self.index:self.index + 2]
+        return [_Namespace(group=int(g), weight=float(w))
+                for g, w in zip(mesh._w_group[start:stop],
+                                mesh._w_weight[start:stop])]
+
+
+class MeshPolygon(object):
+    def __init__(self, mesh, index):
+        self._mesh = mesh
+        self.index = index
+
+    @property
+    def material_index(self):
+        return int(self._mesh._poly_material[self.index])
+
+    @property
+    def loop_start(self):
+        return int(self._mesh._loop_start[self.index])
+
+    @property
+    def loop_total(self):
+        return int(self._mesh._loop_total[self.index])
+
+    @property
+    def loop_indices(self):
+        return range(self.loop_start, self.loop_start + self.loop_total)
+
+    @property
+    def vertices(self):
+        return [int(v) for v in
+                self._mesh._loop_vertex[self.loop_start:
+                                        self.loop_start + self.loop_total]]
+
+
+class MeshLoop(object):
+    def __init__(self, mesh, index):
+        self._mesh = mesh
+        self.index = index
+
+    @property
+    def vertex_index(self):
+        return int(self._mesh._loop_vertex[self.index])
+
+
+class MeshUVLoop(object):
+    def __init__(self, mesh, index):
+        self._mesh = mesh
+        self.index = index
+
+    @property
+    def uv(self):
+        return Vector(self._mesh._uv[self.index])
+
+
+class MeshUVLoopLayer(object):
+    def __init__(self, mesh, name):
+        self.name = name
+        self.data = _ArrayCollection(
+            len(mesh._loop_vertex), lambda i: MeshUVLoop(mesh, i),
+            {'uv': lambda: mesh._uv})
+
+
+class _UVLayers(object):
+    def __init__(self, mesh):
+        self.active = (MeshUVLoopLayer(mesh, 'UVMap')
+                       if mesh._uv is not None else None)
+
+    def __len__(self):
+        return 1 if self.active else 0
+
+    def __iter__(self):
+        return iter([self.active] if self.active else [])
+
+
+class Mesh(object):
+    """Mesh datablock built from column arrays.
+
+    ``weights`` is a CSR triple ``(indptr, group_index, weight)`` holding
+    each vertex's group memberships in ``MeshVertex.groups`` order.
+    """
+
+    def __init__(self, name, co, normals, loop_vertex, loop_start,
+                 loop_total, poly_material, uv=None, weights=None,
+                 materials=()):
+        self.name = name
+        self._co = np.asarray(co, dtype=np.float32).reshape(-1, 3)
+        self._normals = np.asarray(normals, dtype=np.float32).reshape(-1, 3)
+        self._loop_vertex = np.asarray(loop_vertex, dtype=np.int32)
+        self._loop_start = np.asarray(loop_start, dtype=np.int32)
+        self._loop_total = np.asarray(loop_total, dtype=np.int32)
+        self._poly_material = np.asarray(poly_material, dtype=np.int16)
+        self._uv = (None if uv is None else
+                    np.asarray(uv, dtype=np.float32).reshape(-1, 2))
+        if weights is None:
+            weights = (np.zeros(len(self._co) + 1, np.int32),
+                       np.zeros(0, np.int32), np.zeros(0, np.float32))
+        self._w_indptr = np.asarray(weights[0], dtype=np.int64)
+        self._w_group = np.asarray(weights[1], dtype=np.int32)
+        self._w_weight = np.asarray(weights[2], dtype=np.float32)
+        self.materials = list(materials)
+
+        mesh = self
+        self.vertices = _ArrayCollection(
+            len(self._co), lambda i: MeshVertex(mesh, i),
+            {'co': lambda: mesh._co, 'normal': lambda: mesh._normals,
+             'index': lambda: np.arange(len(mesh._co))})
+        self.polygons = _ArrayCollection(
+            len(self._loop_start), lambda i: MeshPolygon(mesh, i),
+            {'loop_start': lambda: mesh._loop_start,
+             'loop_total': lambda: mesh._loop_total,
+             'material_index': lambda: mesh._poly_material,
+             'index': lambda: np.arange(len(mesh._loop_start))})
+        self.loops = _ArrayCollection(
+            len(self._loop_vertex), lambda i: MeshLoop(mesh, i),
+            {'vertex_index': lambda: mesh._loop_vertex})
+        self.uv_layers = _UVLayers(self)
+        self.is_updated = False
+
+
+class Image(object):
+    def __init__(self, filepath, use_alpha=False, colorspace='sRGB'):
+        self.name = os.path.basename(filepath)
+        self.filepath = filepath
+        self.filepath_raw = filepath
+        self.source = 'FILE'
+        self.packed_file = None
+        self.is_dirty = False
+        self.use_alpha = use_alpha
+        self.colorspace_settings = _Namespace(name=colorspace)
+        self.file_format = os.path.splitext(filepath)[1][1:].upper()
+        self.save_render_calls = 0
+
+    def save_render(self, filepath, scene=None):
+        # Blender re-encodes through the render pipeline; model that as a
+        # plain copy so the output is inspectable.
+        self.save_render_calls += 1
+        shutil.copyfile(path.abspath(self.filepath), filepath)
+
+
+class Texture(object):
+    def __init__(self, name, image):
+        self.name = name
+        self.type = 'IMAGE'
+        self.image = image
+        self.extension = 'REPEAT'
+        self.repeat_x = 1
+        self.repeat_y = 1
+
+
+class TextureSlot(object):
+    def __init__(self, texture, texture_coords='UV', mapping='FLAT'):
+        self.texture = texture
+        self.texture_coords = texture_coords
+        self.mapping = mapping
+
+
+class _TextureSlots(object):
+    def __init__(self, slots):
+        self._slots = list(slots) + [None] * (18 - len(slots))
+
+    def values(self):
+        return list(self._slots)
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def __getitem__(self, index):
+        return self._slots[index]
+
+    def __len__(self):
+        return len(self._slots)
+
+
+class Material(object):
+    def __init__(self, name, diffuse=(0.8, 0.8, 0.8), specular=(1, 1, 1),
+                 textures=()):
+        self.name = name
+        self.diffuse_color = Color(diffuse)
+        self.specular_color = Color(specular)
+        self.specular_alpha = 1.0
+        self.ambient = 1.0
+        self.emit = 0.0
+        self.specular_hardness = 50
+        self.texture_slots = _TextureSlots(textures)
+
+
+class Bone(object):
+    def __init__(self, name, head, tail, parent=None):
+        self.name = name
+        self.head_local = Vector(head)
+        self.tail_local = Vector(tail)
+        self.parent = parent
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+        matrix = np.identity(4)
+        matrix[:3, 3] = head
+        self.matrix_local = Matrix(matrix)
+
+
+class _NamedCollection(object):
+    def __init__(self, items=()):
+        self._items = list(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for item in self._items:
+                if item.name == key:
+                    return item
+            raise KeyError(key)
+        return self._items[key]
+
+    def __contains__(self, key):
+        return any(item.name == key for item in self._items)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [item.name for item in self._items]
+
+    def values(self):
+        return list(self._items)
+
+    def append(self, item):
+        self._items.append(item)
+
+    def foreach_get(self, attr, seq):
+        values = []
+        for item in self._items:
+            value = getattr(item, attr)
+            if isinstance(value, Matrix):
+                # RNA lays matrices out column by column
+                value = value._m.T
+            values.append(np.asarray(list(value), dtype=float).ravel())
+        _fill(seq, np.concatenate(values) if values else [])
+
+
+class Armature(object):
+    def __init__(self, name, bones):
+        self.name = name
+        self.bones = _NamedCollection(bones)
+
+
+class Action(object):
+    """Action replaying sampled pose matrices.
+
+    ``matrices`` is (frames, bones, 4, 4), the armature space matrix of
+    every bone in ``bone_names`` for each frame from ``frame_start`` on.
+    """
+
+    def __init__(self, name, bone_names, matrices, frame_start=1):
+        self.name = name
+        self.id_root = 'OBJECT'
+        self._bones = dict((n, i) for i, n in enumerate(bone_names))
+        self._matrices = np.asarray(matrices, dtype=float)
+        self.frame_range = (float(frame_start),
+                            float(frame_start + len(self._matrices) - 1))
+        self.fcurves = [_Namespace(data_path='pose.bones["%s"].'
+                                             'rotation_quaternion' % n,
+                                   array_index=0)
+                        for n in bone_names]
+
+    def _matrix(self, bone_name, frame):
+        start, end = [int(f) for f in self.frame_range]
+        frame = min(max(int(frame), start), end)
+        return Matrix(self._matrices[frame - start, self._bones[bone_name]])
+
+
+class PoseBone(object):
+    def __init__(self, obj, bone):
+        self._obj = obj
+        self.name = bone.name
+        self.bone = bone
+
+    @property
+    def matrix(self):
+        anim_data = self._obj.animation_data
+        action = anim_data.action if anim_data is not None else None
+        if action is None:
+            return self.bone.matrix_local
+        return action._matrix(self.name, context.scene.frame_current)
+
+
+class Pose(object):
+    def __init__(self, obj):
+        self.bones = _NamedCollection(PoseBone(obj, bone)
+                                      for bone in obj.data.bones)
+
+
+class VertexGroup(object):
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class Object(object):
+    def __init__(self, name, data, parent=None):
+        self.name = name
+        self.data = data
+        self.type = 'ARMATURE' if isinstance(data, Armature) else 'MESH'
+        self.children = []
+        self.parent = parent
+        self.vertex_groups = _NamedCollection()
+        self.animation_data = None
+        self.pose = Pose(self) if self.type == 'ARMATURE' else None
+        if parent is not None:
+            parent.children.append(self)
+
+    def animation_data_create(self):
+        if self.animation_data is None:
+            self.animation_data = _Namespace(action=None)
+        return self.animation_data
+
+    def animation_data_clear(self):
+        self.animation_data = None
+
+    @property
+    def active_material(self):
+        materials = getattr(self.data, 'materials', None)
+        return materials[0] if materials else None
+
+
+class _Scene(object):
+    def __init__(self):
+        self.objects = _Namespace(active=None)
+        self.frame_current = 1
+        self.frame_start = 1
+        self.frame_end = 250
+        self.render = _Namespace(fps=24, fps_base=1.0)
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+
+
+class _BlendData(object):
+    def __init__(self):
+        self.filepath = ''
+        self.objects = _NamedCollection()
+        self.materials = _NamedCollection()
+        self.images = _NamedCollection()
+        self.actions = _NamedCollection()
+
+
+class _Path(object):
+    @staticmethod
+    def basename(filepath):
+        return os.path.basename(filepath[2:] if filepath.startswith('//')
+                                else filepath)
+
+    @staticmethod
+    def abspath(filepath):
+        if filepath.startswith('//'):
+            base = os.path.dirname(data.filepath) or os.getcwd()
+            return os.path.join(base, filepath[2:])
+        return filepath
+
+
+class _ObjectOps(object):
+    @staticmethod
+    def mode_set(mode='OBJECT'):
+        return {'FINISHED'}
+
+
+class _Ops(object):
+    object = _ObjectOps()
+
+
+data = _BlendData()
+path = _Path()
+ops = _Ops()
+context = _Namespace(scene=_Scene(), blend_data=data, selected_objects=[],
+                     window_manager=None)
+
+
+def reset():
+    """Drop every datablock, as if a new empty .blend had been opened."""
+    global data
+    data = _BlendData()
+    context.blend_data = data
+    context.scene = _Scene()
+    context.selected_objects = []
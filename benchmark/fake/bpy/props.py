@@ -0,0 +1,16 @@
+"""Property factories; on the stand-in they simply yield their default."""
+
+
+def _default(value):
+    def factory(**kwargs):
+        return kwargs.get('default', value)
+    return factory
+
+
+StringProperty = _default('')
+BoolProperty = _default(False)
+IntProperty = _default(0)
+FloatProperty = _default(0.0)
+EnumProperty = _default('')
+CollectionProperty = _default(())
+PointerProperty = _default(None)
@@ -0,0 +1,23 @@
+"""Base classes the add-on derives from."""
+
+
+class Operator(object):
+    bl_idname = ''
+    bl_label = ''
+
+    def report(self, level, message):
+        print('%s: %s' % ('|'.join(sorted(level)), message))
+
+
+class _Menu(object):
+    def __init__(self):
+        self.entries = []
+
+    def append(self, func):
+        self.entries.append(func)
+
+    def remove(self, func):
+        self.entries.remove(func)
+
+
+INFO_MT_file_export = _Menu()
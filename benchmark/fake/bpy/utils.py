@@ -0,0 +1,11 @@
+"""Class registration no-ops."""
+
+registered = []
+
+
+def register_class(cls):
+    registered.append(cls)
+
+
+def unregister_class(cls):
+    registered.remove(cls)
@@ -0,0 +1,6 @@
+"""Stand-in for ``bpy_extras.io_utils``."""
+
+
+class ExportHelper(object):
+    filepath = ''
+    filename_ext = ''
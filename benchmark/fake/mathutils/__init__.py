@@ -0,0 +1,80 @@
+"""Minimal stand-in for Blender's ``mathutils`` module."""
+
+import numpy as np
+
+
+class Vector(object):
+    def __init__(self, seq=(0.0, 0.0, 0.0)):
+        self._v = [float(c) for c in seq]
+
+    def __len__(self):
+        return len(self._v)
+
+    def __getitem__(self, index):
+        return self._v[index]
+
+    def __iter__(self):
+        return iter(self._v)
+
+    def __sub__(self, other):
+        return Vector([a - b for a, b in zip(self._v, other)])
+
+    def __add__(self, other):
+        return Vector([a + b for a, b in zip(self._v, other)])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __hash__(self):
+        return hash(tuple(self._v))
+
+    def __repr__(self):
+        return 'Vector(%r)' % (tuple(self._v),)
+
+    @property
+    def x(self):
+        return self._v[0]
+
+    @property
+    def y(self):
+        return self._v[1]
+
+    @property
+    def z(self):
+        return self._v[2]
+
+
+class Color(object):
+    def __init__(self, rgb):
+        self.r, self.g, self.b = [float(c) for c in rgb]
+
+    def __iter__(self):
+        return iter((self.r, self.g, self.b))
+
+
+class Matrix(object):
+    def __init__(self, rows=None):
+        if rows is None:
+            rows = np.identity(4)
+        self._m = np.array(rows, dtype=float)
+
+    def __getitem__(self, index):
+        return self._m[index]
+
+    def __iter__(self):
+        return iter(self._m)
+
+    def __len__(self):
+        return len(self._m)
+
+    def inverted(self):
+        return Matrix(np.linalg.inv(self._m))
+
+    def __matmul__(self, other):
+        return Matrix(np.dot(self._m, other._m))
+
+    def __mul__(self, other):
+        return Matrix(np.dot(self._m, other._m))
+
+    def to_translation(self):
+        return Vector(self._m[:3, 3])
@@ -0,0 +1,274 @@
+"""Time io_export_egg.py stage by stage outside of Blender.
+
+The exporter is loaded against the stand-in ``bpy`` in ``fake/`` and run on
+a procedural character from ``synthetic.py``.  Every stage of
+``ExportEggWorker`` is wrapped to collect wall time, and a separate pass
+under ``tracemalloc`` records peak Python memory.  Results are written as
+JSON and can be compared with an earlier result file to catch regressions:
+
+    python benchmark/run_benchmark.py --vertices 60000 --output new.json
+    git show HEAD~5:io_export_egg.py > /tmp/old_io_export_egg.py
+    python benchmark/run_benchmark.py --module /tmp/old_io_export_egg.py \
+        --output old.json
+    python benchmark/run_benchmark.py --baseline old.json
+
+Needs only Python 3 and NumPy.
+"""
+
+import argparse
+import collections
+import contextlib
+import functools
+import io
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'fake'))
+sys.path.insert(0, HERE)
+
+import numpy as np  # noqa: E402
+
+import bpy  # noqa: E402
+import synthetic  # noqa: E402
+
+DEFAULT_MODULE = os.path.join(os.path.dirname(HERE), 'io_export_egg.py')
+
+# ExportEggWorker method -> reported stage; methods missing from older
+# versions of the exporter are skipped.
+STAGES = collections.OrderedDict([
+    ('produce_egg', 'total'),
+    ('_write_textures', 'textures'),
+    ('_write_materials', 'materials'),
+    ('_get_mesh_arrays', 'extract_arrays'),
+    ('_get_vertex_weights', 'extract_weights'),
+    ('_mesh_to_weight_dict', 'extract_weights'),
+    ('_write_vertexPool', 'vertex_pool'),
+    ('_write_polygons', 'polygons'),
+    ('_write_armature', 'armature'),
+    ('_write_animations', 'animations'),
+])
+
+
+def load_exporter(path):
+    spec = importlib.util.spec_from_file_location('io_export_egg', path)
+    module = importlib.util.module_from_spec(spec)
+    # mesh processes pickle their work by module name
+    sys.modules['io_export_egg'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed_worker_class(worker_class, timings):
+    """
+    Return a subclass of worker_class whose stage methods add their
+    inclusive wall time to timings; recursive calls are counted once.
+    """
+    depth = collections.Counter()
+
+    def wrap(method, stage):
+        if inspect.isgeneratorfunction(method):
+            # stepped writers run while they are iterated
+            @functools.wraps(method)
+            def timed_steps(*args, **kwargs):
+                depth[stage] += 1
+                start = time.perf_counter()
+                try:
+                    yield from method(*args, **kwargs)
+                finally:
+                    depth[stage] -= 1
+                    if not depth[stage]:
+                        timings[stage] += time.perf_counter() - start
+            return timed_steps
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            depth[stage] += 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                depth[stage] -= 1
+                if not depth[stage]:
+                    timings[stage] += time.perf_counter() - start
+        return timed
+
+    methods = {}
+    for name, stage in STAGES.items():
+        method = getattr(worker_class, name, None)
+        if method is not None:
+            methods[name] = wrap(method, stage)
+    return type('Timed' + worker_class.__name__, (worker_class,), methods)
+
+
+def export_once(module, human, out_dir, track_memory=False, options=None):
+    timings = collections.Counter()
+    worker_class = timed_worker_class(module.ExportEggWorker, timings)
+    filepath = os.path.join(out_dir, 'character.egg')
+    worker = worker_class(human, '4', filepath, True, **(options or {}))
+    if track_memory:
+        tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            worker.produce_egg()
+        peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    finally:
+        if track_memory:
+            tracemalloc.stop()
+    return timings, peak, os.path.getsize(filepath)
+
+
+def run(args):
+    module = load_exporter(args.module)
+    work_dir = tempfile.mkdtemp(prefix='egg_benchmark_')
+    try:
+        bpy.reset()
+        human = synthetic.build_character(
+            vertices=args.vertices, bones=args.bones,
+            influences=args.influences, meshes=args.meshes,
+            materials=args.materials, textures=args.textures,
+            texture_size=args.texture_size,
+            tex_dir=os.path.join(work_dir, 'source_textures'),
+            seed=args.seed, frames=args.frames)
+        # only ask versions of the exporter that write animations for them
+        options = {'animations': 'ALL'} if args.frames else {}
+        if args.memory_limit:
+            options['memory_limit'] = args.memory_limit
+        runs = []
+        for repeat in range(args.repeat):
+            out_dir = os.path.join(work_dir, 'out%d' % repeat)
+            os.mkdir(out_dir)
+            timings, _, egg_bytes = export_once(module, human, out_dir,
+                                                options=options)
+            runs.append(dict(timings))
+        peak = None
+        if not args.no_memory:
+            out_dir = os.path.join(work_dir, 'out_memory')
+            os.mkdir(out_dir)
+            peak = export_once(module, human, out_dir, True, options)[1]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stages = collections.OrderedDict()
+    for stage in sorted(set(STAGES.values()),
+                        key=list(STAGES.values()).index):
+        values = [r[stage] for r in runs if stage in r]
+        if values:
+            stages[stage] = {'min': min(values),
+                             'mean': sum(values) / len(values)}
+    with open(args.module, 'rb') as fp:
+        module_sha1 = hashlib.sha1(fp.read()).hexdigest()
+    return {
+        'params': {'vertices': args.vertices, 'bones': args.bones,
+                   'influences': args.influences, 'meshes': args.meshes,
+                   'materials': args.materials, 'textures': args.textures,
+                   'texture_size': args.texture_size, 'seed': args.seed,
+                   'frames': args.frames,
+                   'memory_limit': args.memory_limit,
+                   'repeat': args.repeat},
+        'environment': {'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'machine': platform.machine(),
+                        'module': os.path.abspath(args.module),
+                        'module_sha1': module_sha1},
+        'stages': stages,
+        'peak_memory': peak,
+        'egg_bytes': egg_bytes,
+        'runs': runs,
+    }
+
+
+def compare(result, baseline, threshold, min_delta):
+    """
+    Return the stages whose best time is more than threshold (relative)
+    and min_delta seconds slower than in baseline, and the peak memory
+    if it grew by more than threshold, as (stage, old, new) tuples.
+    """
+    if result['params'] != baseline['params']:
+        print('warning: benchmark parameters differ from the baseline')
+    regressions = []
+    for stage, new in result['stages'].items():
+        old = baseline['stages'].get(stage)
+        if (old and new['min'] > old['min'] * (1.0 + threshold) and
+                new['min'] - old['min'] > min_delta):
+            regressions.append((stage, old['min'], new['min']))
+    old_peak = baseline.get('peak_memory')
+    new_peak = result.get('peak_memory')
+    if old_peak and new_peak and new_peak > old_peak * (1.0 + threshold):
+        regressions.append(('peak_memory', old_peak, new_peak))
+    return regressions
+
+
+def print_result(result, baseline=None):
+    print('%-16s %10s %10s %10s' % ('stage', 'min [s]', 'mean [s]',
+                                    'baseline'))
+    for stage, times in result['stages'].items():
+        old = ''
+        if baseline and stage in baseline['stages']:
+            old = '%10.4f' % baseline['stages'][stage]['min']
+        print('%-16s %10.4f %10.4f %10s' % (stage, times['min'],
+                                            times['mean'], old))
+    if result['peak_memory'] is not None:
+        print('peak memory      %10.1f MiB' %
+              (result['peak_memory'] / 1048576.0))
+    print('egg size         %10.1f MiB' % (result['egg_bytes'] / 1048576.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--module', default=DEFAULT_MODULE,
+                        help='exporter file to benchmark')
+    parser.add_argument('--vertices', type=int, default=20000)
+    parser.add_argument('--bones', type=int, default=160)
+    parser.add_argument('--influences', type=int, default=4)
+    parser.add_argument('--meshes', type=int, default=4)
+    parser.add_argument('--materials', type=int, default=3)
+    parser.add_argument('--textures', type=int, default=2,
+                        help='image textures per material')
+    parser.add_argument('--texture-size', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frames', type=int, default=0,
+                        help='frames of an armature action to export')
+    parser.add_argument('--memory-limit', type=int, default=0,
+                        help='memory limit of the export in MiB')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc pass')
+    parser.add_argument('--output', help='write the result as JSON')
+    parser.add_argument('--baseline', help='earlier result JSON to compare')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative slowdown against the '
+                             'baseline')
+    parser.add_argument('--min-delta', type=float, default=0.01,
+                        help='ignore slowdowns below this many seconds')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    result = run(args)
+    print_result(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(result, fp, indent=1)
+    if baseline:
+        regressions = compare(result, baseline, args.threshold,
+                              args.min_delta)
+        for stage, old, new in regressions:
+            print('REGRESSION %s: %.4g -> %.4g' % (stage, old, new))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
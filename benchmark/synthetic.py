@@ -0,0 +1,204 @@
+"""Procedural MakeHuman-scale characters for the stand-in ``bpy``.
+
+A character is an armature object whose children are cylindrical meshes
+(body, clothes, proxies) capped by an n-gon at the top, with a UV seam
+along one column, banded material slots and a configurable number of
+bone influences per vertex.  As on MakeHuman clothes and proxies, the
+last bone keeps an empty vertex group.  Optionally the armature gets a
+swaying action of a given number of frames.
+"""
+
+import os
+import zlib
+import struct
+import tempfile
+
+import numpy as np
+
+import bpy
+
+
+def _png_bytes(width, height, seed):
+    rng = np.random.RandomState(seed)
+    pixels = rng.randint(0, 256, size=(height, width * 3)).astype(np.uint8)
+    raw = b''.join(b'\x00' + row.tobytes() for row in pixels)
+
+    def chunk(tag, payload):
+        body = tag + payload
+        return (struct.pack('>I', len(payload)) + body +
+                struct.pack('>I', zlib.crc32(body) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def _make_images(tex_dir, count, size, prefix):
+    if not os.path.isdir(tex_dir):
+        os.makedirs(tex_dir)
+    images = []
+    for i in range(count):
+        path = os.path.join(tex_dir, '%s_texture_%d.png' % (prefix, i))
+        if not os.path.exists(path):
+            with open(path, 'wb') as fp:
+                fp.write(_png_bytes(size, size, i))
+        image = bpy.Image(path)
+        bpy.data.images.append(image)
+        images.append(image)
+    return images
+
+
+def _make_bones(count, rng, height=1.8):
+    bones = []
+    for i in range(count):
+        if i == 0:
+            parent = None
+        elif i < 8 or rng.rand() < 0.7:
+            parent = bones[i - 1]
+        else:
+            parent = bones[rng.randint(0, i)]
+        base = parent.head_local if parent is not None else (0.0, 0.0, 0.0)
+        head = (base[0] + rng.uniform(-0.05, 0.05),
+                base[1] + rng.uniform(-0.05, 0.05),
+                (i + 0.5) * height / count)
+        tail = (head[0], head[1], head[2] + height / count)
+        bones.append(bpy.Bone('bone.%03d' % i, head, tail, parent))
+    return bones
+
+
+def _rotations(axis, angles):
+    """(frames, 3, 3) rotations by ``angles`` about the unit ``axis``."""
+    x, y, z = axis
+    cross = np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+    s = np.sin(angles)[:, None, None]
+    c = np.cos(angles)[:, None, None]
+    return np.identity(3) + s * cross + (1.0 - c) * np.dot(cross, cross)
+
+
+def _make_action(name, bones, frames, rng):
+    """Every bone turns back and forth about its head, the root bobs."""
+    index = dict((bone.name, i) for i, bone in enumerate(bones))
+    times = np.arange(frames) * (2.0 * np.pi / max(frames, 1))
+    matrices = np.empty((frames, len(bones), 4, 4))
+    for i, bone in enumerate(bones):
+        axis = rng.normal(size=3)
+        axis /= np.linalg.norm(axis)
+        angles = rng.uniform(0.05, 0.5) * np.sin(times +
+                                                 rng.uniform(0, 2 * np.pi))
+        local = np.tile(np.identity(4), (frames, 1, 1))
+        local[:, :3, :3] = _rotations(axis, angles)
+        head = np.array(list(bone.head_local))
+        if bone.parent is None:
+            local[:, :3, 3] = head
+            local[:, 2, 3] += 0.05 * np.sin(2 * times)
+            matrices[:, i] = local
+        else:
+            parent = index[bone.parent.name]
+            local[:, :3, 3] = head - np.array(list(bone.parent.head_local))
+            matrices[:, i] = np.einsum('fij,fjk->fik',
+                                       matrices[:, parent], local)
+    return bpy.Action(name, [bone.name for bone in bones], matrices)
+
+
+def _cylinder(rows, cols, radius, height, offset):
+    ring = np.arange(cols) * (2.0 * np.pi / cols)
+    z = np.linspace(0.0, height, rows)
+    co = np.empty((rows, cols, 3), dtype=np.float32)
+    co[:, :, 0] = radius * np.cos(ring) + offset
+    co[:, :, 1] = radius * np.sin(ring)
+    co[:, :, 2] = z[:, None]
+    normals = np.zeros_like(co)
+    normals[:, :, 0] = np.cos(ring)
+    normals[:, :, 1] = np.sin(ring)
+    co = co.reshape(-1, 3)
+    normals = normals.reshape(-1, 3)
+
+    # Quads between consecutive rings; the last column wraps around to
+    # column 0 with u == 1.0, which is the UV seam.
+    r, c = np.meshgrid(np.arange(rows - 1), np.arange(cols), indexing='ij')
+    r = r.ravel()
+    c = c.ravel()
+    c1 = (c + 1) % cols
+    quads = np.stack([r * cols + c, r * cols + c1,
+                      (r + 1) * cols + c1, (r + 1) * cols + c], axis=1)
+    u0 = c / float(cols)
+    u1 = (c + 1) / float(cols)
+    v0 = r / float(rows - 1)
+    v1 = (r + 1) / float(rows - 1)
+    quad_uv = np.stack([np.stack([u0, v0], 1), np.stack([u1, v0], 1),
+                        np.stack([u1, v1], 1), np.stack([u0, v1], 1)], 1)
+
+    # Top cap as a single n-gon with its own planar projection.
+    cap = (rows - 1) * cols + np.arange(cols)
+    cap_uv = np.stack([0.5 + 0.5 * np.cos(ring), 0.5 + 0.5 * np.sin(ring)], 1)
+
+    loop_vertex = np.concatenate([quads.ravel(), cap])
+    uv = np.concatenate([quad_uv.reshape(-1, 2), cap_uv]).astype(np.float32)
+    loop_total = np.concatenate([np.full(len(quads), 4), [cols]])
+    loop_start = np.concatenate([[0], np.cumsum(loop_total)[:-1]])
+    poly_row = np.concatenate([r, [rows - 2]])
+    return co, normals, loop_vertex, loop_start, loop_total, uv, poly_row
+
+
+def _weights(co, bones, influences, rng):
+    heads = np.array([b.head_local[2] for b in bones])
+    n = len(co)
+    k = min(influences, len(bones))
+    dist = np.abs(co[:, 2][:, None] - heads[None, :])
+    dist += rng.uniform(0.0, 0.05, size=dist.shape)
+    nearest = np.argsort(dist, axis=1)[:, :k]
+    w = rng.uniform(0.05, 1.0, size=(n, k))
+    w /= w.sum(axis=1)[:, None]
+    indptr = np.arange(0, n * k + 1, k)
+    return indptr, nearest.ravel(), w.ravel().astype(np.float32)
+
+
+def build_character(name='human', vertices=20000, bones=160, influences=4,
+                    meshes=4, materials=3, textures=2, texture_size=64,
+                    tex_dir=None, seed=0, frames=0):
+    """Create an armature object with ``meshes`` skinned child meshes.
+
+    ``vertices`` is the approximate vertex count over all meshes.  With
+    ``frames`` the armature plays an action of that many frames.
+    """
+    rng = np.random.RandomState(seed)
+    if tex_dir is None:
+        tex_dir = tempfile.mkdtemp(prefix='egg_benchmark_textures_')
+    bone_list = _make_bones(bones, rng)
+    arm_obj = bpy.Object(name, bpy.Armature(name, bone_list))
+    bpy.data.objects.append(arm_obj)
+
+    images = _make_images(tex_dir, textures * materials, texture_size, name)
+    per_mesh = max(vertices // max(meshes, 1), 16)
+    for m in range(meshes):
+        cols = max(int(np.sqrt(per_mesh)), 4)
+        rows = max(per_mesh // cols, 3)
+        (co, normals, loop_vertex, loop_start, loop_total, uv,
+         poly_row) = _cylinder(rows, cols, 0.2 + 0.01 * m, 1.8, 0.0)
+        mats = []
+        for s in range(materials):
+            slots = [bpy.TextureSlot(bpy.Texture('tex_%d_%d' % (s, t),
+                                                 images[s * textures + t]))
+                     for t in range(textures)]
+            mat = bpy.Material('%s:mesh%d_material_%d' % (name, m, s),
+                               diffuse=rng.uniform(0, 1, 3),
+                               textures=slots)
+            bpy.data.materials.append(mat)
+            mats.append(mat)
+        poly_material = poly_row * materials // (rows - 1)
+        mesh_name = '%s:mesh%d' % (name, m)
+        # no vertex is weighted to the last bone
+        weighted = bone_list[:-1] or bone_list
+        mesh = bpy.Mesh(mesh_name, co, normals, loop_vertex, loop_start,
+                        loop_total, poly_material, uv=uv,
+                        weights=_weights(co, weighted, influences, rng),
+                        materials=mats)
+        obj = bpy.Object(mesh_name, mesh, parent=arm_obj)
+        for i, bone in enumerate(bone_list):
+            obj.vertex_groups.append(bpy.VertexGroup(bone.name, i))
+        bpy.data.objects.append(obj)
+    if frames:
+        action = _make_action('%s_action' % name, bone_list, frames, rng)
+        bpy.data.actions.append(action)
+        arm_obj.animation_data_create().action = action
+    return arm_obj
@@ -21,9 +21,27 @@
 import bpy
 
 import os.path
+import io
+import array
+import copy
+import sys
+import json
 import time
-import codecs
+import zlib
+import pickle
 import shutil
+import hashlib
+import platform
+import functools
+import inspect
+import tempfile
+import itertools
+import contextlib
+import collections
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
 
 import numpy.linalg as la
 import numpy as np
@@ -32,13 +50,27 @@ from math import radians
 from math import pi
 from mathutils import *
 
-import bmesh
+try:
+    import resource
+except ImportError:
+    # not available on Windows, max_rss is left out of the report
+    resource = None
+
+try:
+    from panda3d.core import (ConfigVariableBool, DSearchPath, Filename,
+                              NodePath)
+    from panda3d.egg import EggData, loadEggData
+except ImportError:
+    # .bam output needs Panda3D's Python modules in Blender's Python
+    EggData = None
 
 from bpy_extras.io_utils import ExportHelper
 from bpy.props import (
         StringProperty,
         BoolProperty,
         EnumProperty,
+        IntProperty,
+        FloatProperty,
         )
 
 bl_info = {
@@ -60,6 +92,8 @@ _Identity = np.identity(4, float)
 
 def good_file_name(filepath):
     filename = os.path.basename(filepath)
+    if filename.endswith('.pz'):
+        filename = filename[:-3]
     name = os.path.splitext(filename)[0]
     string = name.replace(' ', '_').replace('-', '_')
     return string
@@ -82,18 +116,1733 @@ def good_material_name(material_name):
     return material_name.replace(' ', '_').split(':')[-1]
 
 
+def good_node_name(name):
+    return name.replace(' ', '_').replace('.', '_').replace('-', '_')
+
+
+def unique_name(name, used):
+    """
+    Return name, or name with the first free _1, _2, ... suffix when
+    it is in used, and add the result to used.
+    """
+    unique = name
+    number = 0
+    while unique in used:
+        number += 1
+        unique = '%s_%d' % (name, number)
+    used.add(unique)
+    return unique
+
+
+def export_filepath(filepath, export_format='EGG', compress=False):
+    """
+    Adjust the extension of filepath to the output format.
+    """
+    if export_format == 'BAM':
+        return os.path.splitext(filepath)[0] + '.bam'
+    if compress and not filepath.endswith('.pz'):
+        return filepath + '.pz'
+    return filepath
+
+
+def suffixed_filepath(filepath, name):
+    """
+    Path of a file written next to filepath for name, an action or a
+    character, e.g. human-walk.egg.pz for human.egg.pz and walk.
+    """
+    base, ext = os.path.splitext(filepath)
+    if ext == '.pz':
+        base, egg_ext = os.path.splitext(base)
+        ext = egg_ext + ext
+    return '%s-%s%s' % (base, good_node_name(name), ext)
+
+
+def fcurve_bone_name(data_path):
+    """
+    Name of the pose bone an F-Curve data_path such as
+    'pose.bones["hand.L"].location' animates, None for other paths.
+    """
+    prefix = 'pose.bones["'
+    if not data_path.startswith(prefix):
+        return None
+    return data_path[len(prefix):].split('"]')[0]
+
+
+def selected_characters(objects):
+    """
+    The armatures among objects or parenting one of them, each once, in
+    selection order.
+    """
+    characters = []
+    for obj in objects:
+        if (obj.type != 'ARMATURE' and obj.parent is not None and
+                obj.parent.type == 'ARMATURE'):
+            obj = obj.parent
+        if obj.type == 'ARMATURE' and obj not in characters:
+            characters.append(obj)
+    return characters
+
+
+def mesh_processes(use_processes):
+    """
+    Number of mesh rendering processes for the use_processes option.
+    The processes are forked, which is only safe on Linux: Windows has
+    no fork and a spawned child would start the Blender binary, and a
+    forked child of Blender's Cocoa process on macOS may crash. Meshes
+    are rendered in this process elsewhere.
+    """
+    if not use_processes or not sys.platform.startswith('linux'):
+        return 0
+    return os.cpu_count() or 1
+
+
+def fork_process_pool(max_workers):
+    """
+    Return a ProcessPoolExecutor whose max_workers processes are forked
+    right away, before the caller starts any threads.
+    """
+    if sys.version_info >= (3, 7):
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        # fork is the default start method of these versions
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers)
+    # the first task starts every process
+    pool.submit(int).result()
+    return pool
+
+
+class MeshArrays(object):
+    """
+    Column arrays of a mesh, pulled out of Blender in bulk with
+    foreach_get instead of per-vertex RNA attribute access.
+    co and normals are (vertices, 3), uv is (loops, 2) or None when
+    the mesh has no active UV layer.
+    """
+    def __init__(self, mesh):
+        vertices_tot = len(mesh.vertices)
+        loops_tot = len(mesh.loops)
+        polygons_tot = len(mesh.polygons)
+        self.co = np.empty(vertices_tot * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', self.co)
+        self.co.shape = (vertices_tot, 3)
+        self.normals = np.empty(vertices_tot * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('normal', self.normals)
+        self.normals.shape = (vertices_tot, 3)
+        self.loop_vertex = np.empty(loops_tot, dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', self.loop_vertex)
+        self.loop_start = np.empty(polygons_tot, dtype=np.int32)
+        mesh.polygons.foreach_get('loop_start', self.loop_start)
+        self.loop_total = np.empty(polygons_tot, dtype=np.int32)
+        mesh.polygons.foreach_get('loop_total', self.loop_total)
+        self.material_index = np.empty(polygons_tot, dtype=np.int32)
+        mesh.polygons.foreach_get('material_index', self.material_index)
+        uv_layer = mesh.uv_layers.active
+        if uv_layer is None:
+            self.uv = None
+        else:
+            self.uv = np.empty(loops_tot * 2, dtype=np.float32)
+            uv_layer.data.foreach_get('uv', self.uv)
+            self.uv.shape = (loops_tot, 2)
+
+    def first_loop_uvs(self):
+        """
+        UV of the first loop using each vertex, (0, 0) for loose vertices.
+        """
+        uvs = np.zeros((len(self.co), 2), dtype=np.float32)
+        if self.uv is not None and len(self.loop_vertex):
+            vertices, first_loops = np.unique(self.loop_vertex,
+                                              return_index=True)
+            uvs[vertices] = self.uv[first_loops]
+        return uvs
+
+    def polygon_vertices(self):
+        """
+        Yield the vertex indices of each polygon as a list.
+        """
+        loop_vertex = self.loop_vertex.tolist()
+        for start, total in zip(self.loop_start.tolist(),
+                                self.loop_total.tolist()):
+            yield loop_vertex[start:start + total]
+
+
+class VertexWeights(object):
+    """
+    Vertex group weights of a mesh in CSR form: the memberships of
+    vertex v are groups[indptr[v]:indptr[v+1]] with the matching
+    weights, vertices holds the vertex index of every membership.
+    weight_format turns a weight into its membership label.
+    """
+    def __init__(self, mesh_obj, weight_format):
+        self.weight_format = weight_format
+        self.group_names = [g.name for g in mesh_obj.vertex_groups]
+        group_names_tot = len(self.group_names)
+        mesh = mesh_obj.data
+        counts = np.zeros(len(mesh.vertices), dtype=np.int64)
+        # typed arrays take 4 bytes a membership instead of two objects
+        groups = array.array('i')
+        weights = array.array('f')
+        if group_names_tot:
+            for v in mesh.vertices:
+                count = 0
+                for g in v.groups:
+                    # possible weights are out of range
+                    if g.group < group_names_tot:
+                        groups.append(g.group)
+                        weights.append(g.weight)
+                        count += 1
+                counts[v.index] = count
+        self.indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.vertices = np.repeat(np.arange(len(counts), dtype=np.int32),
+                                  counts)
+        self.groups = np.frombuffer(groups, dtype=np.int32)
+        self.weights = np.frombuffer(weights, dtype=np.float32)
+        self._memberships = None
+
+    def take(self, vertices, chunk_size=65536):
+        """
+        Return the weights of the given vertex indices, in that order,
+        as a new VertexWeights. The memberships are gathered for
+        chunk_size vertices at a time.
+        """
+        counts = np.diff(self.indptr)[vertices]
+        taken = copy.copy(self)
+        taken.indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=taken.indptr[1:])
+        taken.vertices = np.repeat(np.arange(len(counts), dtype=np.int32),
+                                   counts)
+        taken.groups = np.empty(taken.indptr[-1], dtype=self.groups.dtype)
+        taken.weights = np.empty(taken.indptr[-1], dtype=self.weights.dtype)
+        for start in range(0, len(counts), chunk_size):
+            stop = start + chunk_size
+            bounds = taken.indptr[start:stop + 1]
+            rows = (np.repeat(self.indptr[vertices[start:stop]] -
+                              bounds[:-1], counts[start:stop]) +
+                    np.arange(bounds[0], bounds[-1]))
+            taken.groups[bounds[0]:bounds[-1]] = self.groups[rows]
+            taken.weights[bounds[0]:bounds[-1]] = self.weights[rows]
+        taken._memberships = None
+        return taken
+
+    def limited(self, max_influences=0, min_weight=0.0, group_names=None):
+        """
+        Return a new VertexWeights without the groups missing from
+        group_names, the weights below min_weight and all but the
+        max_influences largest weights of every vertex (0 keeps all).
+        A vertex keeps at least its largest weight, and its kept weights
+        are scaled to add up to its total weight in group_names.
+        """
+        vertices_tot = len(self.indptr) - 1
+        keep = np.ones(len(self.groups), dtype=bool)
+        if group_names is not None:
+            known = np.array([name in group_names
+                              for name in self.group_names], dtype=bool)
+            keep &= known[self.groups]
+        totals = np.bincount(self.vertices[keep], self.weights[keep],
+                             minlength=vertices_tot)
+        # rank the kept weights of each vertex from the largest down
+        order = np.lexsort((-self.weights, ~keep, self.vertices))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = (np.arange(len(order)) -
+                       self.indptr[self.vertices[order]])
+        if min_weight > 0.0:
+            keep &= (self.weights >= min_weight) | (rank == 0)
+        if max_influences > 0:
+            keep &= rank < max_influences
+        limited = copy.copy(self)
+        limited.vertices = self.vertices[keep]
+        limited.groups = self.groups[keep]
+        weights = self.weights[keep]
+        kept_totals = np.bincount(limited.vertices, weights,
+                                  minlength=vertices_tot)
+        scale = np.ones(vertices_tot)
+        np.divide(totals, kept_totals, out=scale, where=kept_totals > 0)
+        limited.weights = (weights * scale[limited.vertices]).astype(
+            np.float32)
+        limited.indptr = np.zeros(vertices_tot + 1, dtype=np.int64)
+        np.cumsum(np.bincount(limited.vertices, minlength=vertices_tot),
+                  out=limited.indptr[1:])
+        limited._memberships = None
+        return limited
+
+    def group_index(self, group_name):
+        try:
+            return self.group_names.index(group_name)
+        except ValueError:
+            return None
+
+    def _label_ranks(self, unique_weights, chunk_size=65536):
+        """
+        Return the sorted distinct labels of the sorted unique_weights
+        and the label index of each weight.
+        """
+        if len(unique_weights) and (unique_weights[0] < 0.0 or
+                                    unique_weights[-1] >= 9.0):
+            unique_labels = [self.weight_format.format(w)
+                             for w in unique_weights.tolist()]
+            labels = sorted(set(unique_labels))
+            label_rank = dict((label, rank)
+                              for rank, label in enumerate(labels))
+            return labels, np.array([label_rank[label]
+                                     for label in unique_labels],
+                                    dtype=np.int32)
+        # Labels of weights in [0, 9) have one integer digit, so they
+        # sort like the weights and equal ones are neighbours. They are
+        # formatted a chunk at a time and only the distinct ones kept,
+        # at most one per step of the weight precision.
+        labels = []
+        ranks = np.empty(len(unique_weights), dtype=np.int32)
+        for start in range(0, len(unique_weights), chunk_size):
+            chunk = np.array([self.weight_format.format(w) for w in
+                              unique_weights[start:start +
+                                             chunk_size].tolist()])
+            new = np.ones(len(chunk), dtype=bool)
+            new[1:] = chunk[1:] != chunk[:-1]
+            if labels:
+                new[0] = chunk[0] != labels[-1]
+            ranks[start:start + len(chunk)] = (len(labels) - 1 +
+                                               np.cumsum(new))
+            labels.extend(chunk[new].tolist())
+        return labels, ranks
+
+    def _build_memberships(self):
+        # Only the distinct weight values are formatted; every membership
+        # is then labelled through np.unique's inverse index and the
+        # non-zero memberships are sorted by (group, label, vertex).
+        nonzero = self.weights != 0.0
+        weights = self.weights[nonzero]
+        unique_weights, inverse = np.unique(weights, return_inverse=True)
+        labels, ranks = self._label_ranks(unique_weights)
+        ranks = ranks[inverse]
+        groups = self.groups[nonzero]
+        vertices = self.vertices[nonzero]
+        order = np.lexsort((vertices, ranks, groups))
+        groups = groups[order]
+        group_bounds = np.searchsorted(
+            groups, np.arange(len(self.group_names) + 1))
+        self._memberships = (labels, ranks[order], vertices[order],
+                             group_bounds)
+
+    def memberships(self, group_index):
+        """
+        Return the non-zero memberships of a group as a list of
+        (weight label, sorted vertex index list), ordered by label; empty
+        for a group without any.
+        """
+        if self._memberships is None:
+            self._build_memberships()
+        labels, ranks, vertices, group_bounds = self._memberships
+        start, stop = group_bounds[group_index:group_index + 2]
+        if start == stop:
+            return []
+        ranks = ranks[start:stop]
+        bounds = np.flatnonzero(np.diff(ranks)) + 1
+        starts = [0] + bounds.tolist()
+        stops = bounds.tolist() + [len(ranks)]
+        rank_list = ranks.tolist()
+        vertex_list = vertices[start:stop].tolist()
+        return [(labels[rank_list[a]], vertex_list[a:b])
+                for a, b in zip(starts, stops)]
+
+
+class VertexPool(object):
+    """
+    The egg vertices of a mesh. With split_seams every Blender vertex
+    becomes one egg vertex per distinct UV of its loops, UVs compared
+    at uv_precision decimal places, otherwise it keeps the UV of its
+    first loop. source holds the Blender vertex of each egg vertex,
+    which are ordered by Blender vertex and then by first loop, so a
+    mesh without seams keeps its vertex numbering. loop_vertex maps
+    the loops to egg vertices and weights are the VertexWeights of
+    the egg vertices. The polygons are loop_start, loop_total and
+    material_index, as in MeshArrays. The seams are split for chunk_size
+    loops at a time.
+    """
+    def __init__(self, arrays, vertex_weights, split_seams=True,
+                 uv_precision=4, chunk_size=65536):
+        vertices_tot = len(arrays.co)
+        self.loop_start = arrays.loop_start
+        self.loop_total = arrays.loop_total
+        self.material_index = arrays.material_index
+        if arrays.uv is None or not split_seams:
+            self.source = np.arange(vertices_tot, dtype=np.int32)
+            self.co = arrays.co
+            self.normals = arrays.normals
+            self.uvs = None if arrays.uv is None else arrays.first_loop_uvs()
+            self.loop_vertex = arrays.loop_vertex
+            self.weights = vertex_weights
+            return
+        # Sort the loops by (vertex, quantized UV, loop) and number the
+        # distinct keys; the first loop of a key provides the UV. The
+        # loops are sorted by vertex first and then by UV for a chunk of
+        # whole vertices at a time, so only a chunk is ever quantized.
+        loop_vertex = arrays.loop_vertex
+        loops_tot = len(loop_vertex)
+        order = np.argsort(loop_vertex, kind='mergesort').astype(np.int32)
+        sorted_vertex = loop_vertex[order]
+        first = np.ones(loops_tot, dtype=bool)
+        start = 0
+        while start < loops_tot:
+            stop = int(np.searchsorted(
+                sorted_vertex,
+                sorted_vertex[min(start + chunk_size, loops_tot) - 1],
+                side='right'))
+            loops = order[start:stop]
+            quantized = np.round(arrays.uv[loops].astype(np.float64) *
+                                 10.0 ** uv_precision).astype(np.int64)
+            # stable, so equal keys stay in loop order
+            chunk_order = np.lexsort((quantized[:, 1], quantized[:, 0],
+                                      sorted_vertex[start:stop]))
+            order[start:stop] = loops[chunk_order]
+            vertex = sorted_vertex[start:stop]
+            quantized = quantized[chunk_order]
+            first[start + 1:stop] = ((vertex[1:] != vertex[:-1]) |
+                                     (quantized[1:, 0] != quantized[:-1, 0]) |
+                                     (quantized[1:, 1] != quantized[:-1, 1]))
+            start = stop
+        key = np.cumsum(first, dtype=np.int32)
+        key -= 1
+        first_loops = order[first]
+        # loose vertices have no loops and keep a (0, 0) UV
+        used = np.zeros(vertices_tot, dtype=bool)
+        used[loop_vertex] = True
+        loose = np.flatnonzero(~used).astype(np.int32)
+        source = np.concatenate([loop_vertex[first_loops], loose])
+        entry_loop = np.concatenate([first_loops,
+                                     np.full(len(loose), -1, np.int64)])
+        entry_order = np.lexsort((entry_loop, source))
+        position = np.empty(len(source), dtype=np.int32)
+        position[entry_order] = np.arange(len(source), dtype=np.int32)
+        self.source = source[entry_order].astype(np.int32)
+        self.co = arrays.co[self.source]
+        self.normals = arrays.normals[self.source]
+        self.uvs = np.zeros((len(source), 2), dtype=np.float32)
+        self.uvs[position[:len(first_loops)]] = arrays.uv[first_loops]
+        self.loop_vertex = np.empty(loops_tot, dtype=np.int32)
+        self.loop_vertex[order] = position[key]
+        self.weights = vertex_weights.take(self.source)
+
+    def optimize_vertex_cache(self, cache_size=16):
+        """
+        Triangulate the polygons as fans, order the triangles for a
+        post-transform vertex cache of cache_size entries and renumber
+        the vertices in first use order. Fans are exact for the convex
+        polygons of MakeHuman meshes.
+        """
+        polygon, corners = fan_triangles(self.loop_start, self.loop_total)
+        triangles = self.loop_vertex[corners]
+        order = tipsify(triangles, len(self.co), cache_size)
+        triangles = triangles[order]
+        polygon = polygon[order]
+        # first use order, unused vertices keep their order at the end
+        vertices_tot = len(self.co)
+        flat = triangles.ravel()
+        first_use = np.full(vertices_tot, len(flat), dtype=np.int64)
+        np.minimum.at(first_use, flat, np.arange(len(flat)))
+        renumber = np.lexsort((np.arange(vertices_tot), first_use))
+        position = np.empty(vertices_tot, dtype=np.int32)
+        position[renumber] = np.arange(vertices_tot, dtype=np.int32)
+        self.source = self.source[renumber]
+        self.co = self.co[renumber]
+        self.normals = self.normals[renumber]
+        if self.uvs is not None:
+            self.uvs = self.uvs[renumber]
+        self.weights = self.weights.take(renumber)
+        self.loop_vertex = position[flat]
+        self.loop_start = np.arange(0, len(flat), 3, dtype=np.int32)
+        self.loop_total = np.full(len(triangles), 3, dtype=np.int32)
+        self.material_index = self.material_index[polygon]
+
+    def decimated(self, ratio):
+        """
+        Return a triangulated VertexPool with about ratio times the
+        vertices, made by vertex clustering: the vertices are binned in
+        a grid over position and UV, each bin is replaced by its vertex
+        closest to the bin's mean position and the triangles collapsing
+        on the way are dropped. Kept vertices keep their UV, normal and
+        weights, and seams stay apart as long as their UVs differ by
+        more than a grid cell.
+        """
+        vertices_tot = len(self.co)
+        lod = copy.copy(self)
+        if not vertices_tot:
+            return lod
+        target = max(int(vertices_tot * ratio), 1)
+        low = self.co.min(axis=0)
+        extent = max(float((self.co.max(axis=0) - low).max()), 1e-6)
+        unit = (self.co - low) / extent
+        uvs = self.uvs
+        if uvs is None:
+            uvs = np.zeros((vertices_tot, 2), dtype=np.float32)
+
+        def clusters(cells):
+            cell = np.minimum((unit * cells).astype(np.int64), cells - 1)
+            uv_cell = np.floor(uvs * cells).astype(np.int64)
+            return _group_rows(cell[:, 0], cell[:, 1], cell[:, 2],
+                               uv_cell[:, 0], uv_cell[:, 1])
+        # the finest grid that reaches the target
+        low_cells, high_cells = 1, 4096
+        while low_cells < high_cells:
+            cells = (low_cells + high_cells + 1) // 2
+            if clusters(cells)[1] <= target:
+                low_cells = cells
+            else:
+                high_cells = cells - 1
+        group, groups_tot = clusters(low_cells)
+        counts = np.bincount(group, minlength=groups_tot)
+        mean = np.column_stack([
+            np.bincount(group, self.co[:, axis], minlength=groups_tot)
+            for axis in range(3)]) / counts[:, None]
+        distance = ((self.co - mean[group]) ** 2).sum(axis=1)
+        order = np.lexsort((distance, group))
+        first = np.ones(vertices_tot, dtype=bool)
+        first[1:] = group[order][1:] != group[order][:-1]
+        keep = np.sort(order[first])
+        position = np.empty(groups_tot, dtype=np.int32)
+        position[group[keep]] = np.arange(len(keep), dtype=np.int32)
+        polygon, corners = fan_triangles(self.loop_start, self.loop_total)
+        triangles = position[group[self.loop_vertex[corners]]]
+        valid = ((triangles[:, 0] != triangles[:, 1]) &
+                 (triangles[:, 1] != triangles[:, 2]) &
+                 (triangles[:, 0] != triangles[:, 2]))
+        triangles = triangles[valid]
+        polygon = polygon[valid]
+        # faces collapsing onto the same triangle are written once
+        corners = np.sort(triangles, axis=1)
+        same, _ = _group_rows(corners[:, 0], corners[:, 1], corners[:, 2])
+        order = np.lexsort((np.arange(len(same)), same))
+        first = np.ones(len(same), dtype=bool)
+        first[1:] = same[order][1:] != same[order][:-1]
+        unique = np.sort(order[first])
+        lod.source = self.source[keep]
+        lod.co = self.co[keep]
+        lod.normals = self.normals[keep]
+        if self.uvs is not None:
+            lod.uvs = self.uvs[keep]
+        lod.weights = self.weights.take(keep)
+        lod.loop_vertex = triangles[unique].ravel().astype(np.int32)
+        lod.loop_start = np.arange(0, len(lod.loop_vertex), 3,
+                                   dtype=np.int32)
+        lod.loop_total = np.full(len(unique), 3, dtype=np.int32)
+        lod.material_index = self.material_index[polygon[unique]]
+        return lod
+
+
+def _group_rows(*columns):
+    """
+    Number the distinct rows of equally long integer columns in sorted
+    row order; returns the group of each row and the number of groups.
+    """
+    rows_tot = len(columns[0])
+    if not rows_tot:
+        return np.zeros(0, dtype=np.int64), 0
+    order = np.lexsort(columns[::-1])
+    change = np.zeros(rows_tot, dtype=bool)
+    change[0] = True
+    for column in columns:
+        column = column[order]
+        change[1:] |= column[1:] != column[:-1]
+    group = np.empty(rows_tot, dtype=np.int64)
+    group[order] = np.cumsum(change) - 1
+    return group, int(change.sum())
+
+
+def fan_triangles(loop_start, loop_total):
+    """
+    Split polygons into triangle fans around their first loop. Returns
+    the polygon of each triangle and its (triangles, 3) loop indices;
+    polygons with less than 3 loops are dropped.
+    """
+    counts = np.maximum(loop_total.astype(np.int64) - 2, 0)
+    polygon = np.repeat(np.arange(len(loop_start)), counts)
+    first_triangle = np.cumsum(counts) - counts
+    step = np.arange(counts.sum()) - first_triangle[polygon] + 1
+    start = loop_start[polygon].astype(np.int64)
+    corners = np.column_stack((start, start + step, start + step + 1))
+    return polygon, corners
+
+
+def tipsify(triangles, vertices_tot, cache_size=16):
+    """
+    Return an order of the (triangles, 3) vertex index array that makes
+    good use of a post-transform vertex cache of cache_size entries,
+    using the linear time Tipsify algorithm (Sander, Nehab and Barczak,
+    "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw",
+    2007): fan around a vertex that is still in the cache, else around
+    the last one left with live triangles.
+    """
+    triangles_tot = len(triangles)
+    if not triangles_tot:
+        return np.zeros(0, dtype=np.int64)
+    flat = triangles.ravel()
+    live = np.bincount(flat, minlength=vertices_tot)
+    bounds = np.zeros(vertices_tot + 1, dtype=np.int64)
+    np.cumsum(live, out=bounds[1:])
+    adjacency = (np.argsort(flat, kind='mergesort') // 3).tolist()
+    bounds = bounds.tolist()
+    live = live.tolist()
+    corners = triangles.tolist()
+    stamps = [0] * vertices_tot
+    emitted = [False] * triangles_tot
+    dead_ends = []
+    order = []
+    time_stamp = cache_size + 1
+    cursor = 0
+    fan = int(flat[0])
+    while fan >= 0:
+        candidates = []
+        for t in adjacency[bounds[fan]:bounds[fan+1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in corners[t]:
+                dead_ends.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time_stamp - stamps[v] > cache_size:
+                    stamps[v] = time_stamp
+                    time_stamp += 1
+        # the candidate staying longest in the cache after its fan
+        fan = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time_stamp - stamps[v] + 2*live[v] <= cache_size:
+                    priority = time_stamp - stamps[v]
+                if priority > best:
+                    best = priority
+                    fan = v
+        if fan < 0:
+            while dead_ends:
+                v = dead_ends.pop()
+                if live[v] > 0:
+                    fan = v
+                    break
+        if fan < 0:
+            while cursor < vertices_tot:
+                if live[cursor] > 0:
+                    fan = cursor
+                    break
+                cursor += 1
+    return np.array(order, dtype=np.int64)
+
+
+class TextureEntry(object):
+    """
+    One distinct image texture: the egg name, the image and how it is
+    mapped, and the file name of its copy in the textures folder.
+    """
+    def __init__(self, tslot, name, filename):
+        self.texture = tslot.texture
+        self.image = tslot.texture.image
+        self.texture_coords = tslot.texture_coords
+        self.mapping = tslot.mapping
+        self.name = name
+        self.filename = filename
+
+    @staticmethod
+    def content_key(tslot):
+        texture = tslot.texture
+        image = texture.image
+        return (bpy.path.abspath(image.filepath), texture.extension,
+                texture.repeat_x, texture.repeat_y, tslot.texture_coords,
+                tslot.mapping, image.use_alpha,
+                image.colorspace_settings.name)
+
+
+class MaterialEntry(object):
+    """
+    Egg name and image textures of one Blender material.
+    """
+    def __init__(self, mat, textures):
+        self.material = mat
+        self.name = good_material_name(mat.name)
+        self.textures = textures
+        self.texture_names = [texture.name for texture in textures]
+        self.image_textures = [texture for texture in textures
+                               if getattr(texture.image, 'source',
+                                          '') == 'FILE']
+
+    def content_key(self):
+        mat = self.material
+        values = (tuple(mat.diffuse_color) + tuple(mat.specular_color) +
+                  (mat.specular_alpha, mat.ambient, mat.emit,
+                   mat.specular_hardness))
+        return (tuple(['%.4f' % value for value in values]),
+                tuple(self.texture_names))
+
+
+class MaterialIndex(object):
+    """
+    Material lookup built once per export, or shared by the exports of
+    a batch: one MaterialEntry per material, and per mesh a list of
+    entries indexed by material slot (None for empty slots).
+    Materials and textures are deduplicated by content. Materials of
+    any character agreeing in every written value and texture share one
+    entry, so an egg holds each only once, and different ones never
+    share an egg name or a texture file name.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._content = {}
+        self._material_names = set()
+        self._textures = {}
+        self._texture_names = set()
+        self._texture_files = {}
+        self._file_names = set()
+        self._mesh_slots = {}
+
+    def entry(self, mat):
+        entry = self._entries.get(mat.name)
+        if entry is None:
+            textures = [self.texture(tslot)
+                        for tslot in mat.texture_slots.values()
+                        if tslot is not None and
+                        tslot.texture.type == 'IMAGE' and
+                        tslot.texture.image is not None]
+            entry = MaterialEntry(mat, textures)
+            key = entry.content_key()
+            if key in self._content:
+                entry = self._content[key]
+            else:
+                entry.name = unique_name(entry.name, self._material_names)
+                self._content[key] = entry
+            self._entries[mat.name] = entry
+        return entry
+
+    def texture(self, tslot):
+        key = TextureEntry.content_key(tslot)
+        texture = self._textures.get(key)
+        if texture is None:
+            filepath = tslot.texture.image.filepath
+            source = key[0]
+            filename = self._texture_files.get(source)
+            if filename is None:
+                base, ext = os.path.splitext(os.path.basename(filepath))
+                filename = base + ext
+                number = 0
+                while filename in self._file_names:
+                    number += 1
+                    filename = '%s_%d%s' % (base, number, ext)
+                self._file_names.add(filename)
+                self._texture_files[source] = filename
+            name = unique_name(good_texture_name(filepath),
+                               self._texture_names)
+            texture = TextureEntry(tslot, name, filename)
+            self._textures[key] = texture
+        return texture
+
+    def used_entries(self, meshes):
+        """
+        The distinct entries of the material slots of mesh objects, in
+        order of first use.
+        """
+        entries = collections.OrderedDict()
+        for mesh_obj in meshes:
+            for entry in self.mesh_slots(mesh_obj.data):
+                if entry:
+                    entries[id(entry)] = entry
+        return list(entries.values())
+
+    def mesh_slots(self, mesh):
+        slots = self._mesh_slots.get(mesh.name)
+        if slots is None:
+            slots = [self.entry(mat) if mat else None
+                     for mat in mesh.materials]
+            self._mesh_slots[mesh.name] = slots
+        return slots
+
+
+class EggFormatter(object):
+    """
+    Renders whole blocks of egg text (vertex pools, polygon lists,
+    <VertexRef> lists) from arrays in a single pass.
+    vertex_precision applies to positions, UVs and normals,
+    comment_precision to the per-vertex weight comments and
+    transform_precision to joint translations.
+    """
+    def __init__(self, vertex_precision=4, comment_precision=8,
+                 transform_precision=5):
+        self.vertex_precision = vertex_precision
+        self.comment_precision = comment_precision
+        self.transform_precision = transform_precision
+        self._vertex_float = '%%.%df' % vertex_precision
+        self._comment_float = '%%.%df' % comment_precision
+        self._transform_float = '%%.%df' % transform_precision
+
+    def indices(self, values):
+        """
+        Space separated integers of a list, each followed by a space.
+        """
+        if not len(values):
+            return ''
+        return ' '.join(map(str, values)) + ' '
+
+    def weight_comments(self, padding, vertex_weights, start=0, stop=None):
+        """
+        Return one string per vertex of start:stop with a '// bone:weight'
+        comment line for each of its non-zero weights.
+        """
+        template = '%s  // %%s:%s\n' % (padding, self._comment_float)
+        names = [good_bone_name(name) for name in vertex_weights.group_names]
+        if stop is None:
+            stop = len(vertex_weights.indptr) - 1
+        bounds = vertex_weights.indptr[start:stop+1]
+        first, last = bounds[0], bounds[-1]
+        bounds = (bounds - first).tolist()
+        entries = [template % (names[g_index], weight) if weight != 0.0
+                   else ''
+                   for g_index, weight in zip(
+                       vertex_weights.groups[first:last].tolist(),
+                       vertex_weights.weights[first:last].tolist())]
+        return [''.join(entries[start:stop])
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def vertices(self, padding, co, normals, uvs=None, comments=None,
+                 first_index=0):
+        """
+        Render the <Vertex> entries of a vertex pool. uvs and comments
+        are optional per-vertex columns.
+        """
+        f = self._vertex_float
+        template = ('%s<Vertex> %%d {\n' % padding +
+                    '%s  %s %s %s\n' % (padding, f, f, f))
+        columns = [range(first_index, first_index + len(co)),
+                   co[:, 0].tolist(), co[:, 1].tolist(), co[:, 2].tolist()]
+        if uvs is not None:
+            template += '%s  <UV> { %s %s }\n' % (padding, f, f)
+            columns += [uvs[:, 0].tolist(), uvs[:, 1].tolist()]
+        template += ('%s  <Normal> { %s %s %s }\n' % (padding, f, f, f) +
+                     '%%s%s}\n' % padding)
+        columns += [normals[:, 0].tolist(), normals[:, 1].tolist(),
+                    normals[:, 2].tolist()]
+        if comments is None:
+            comments = itertools.repeat('', len(co))
+        columns.append(comments)
+        return ''.join([template % row for row in zip(*columns)])
+
+    def polygon_state(self, padding, entry):
+        """
+        Render the <TRef>/<MRef> lines and the <VertexRef> opening shared
+        by every polygon of a material slot.
+        """
+        state = ''
+        if entry:
+            for tex_name in entry.texture_names:
+                state += '%s  <TRef> { %s }\n' % (padding, tex_name)
+            state += '%s  <MRef> { %s }\n' % (padding, entry.name)
+        return state + '%s  <VertexRef> { \n' % padding + '%s    ' % padding
+
+    def polygons(self, padding, pool_name, states, state_index, loop_start,
+                 loop_total, loop_vertex, first_index=0):
+        """
+        Render <Polygon> entries. Polygon p uses states[state_index[p]]
+        and the vertices loop_vertex[loop_start[p]:+loop_total[p]].
+        """
+        polygons_tot = len(loop_start)
+        if not polygons_tot:
+            return ''
+        # Lay out a flat token list: header, state, one token per loop
+        # and the closing text for every polygon, then join it once.
+        loops_tot = int(loop_total.sum())
+        ends = np.cumsum(loop_total)
+        starts = ends - loop_total
+        loop_order = (np.repeat(loop_start - starts, loop_total) +
+                      np.arange(loops_tot))
+        tokens = np.empty(loops_tot + 3 * polygons_tot, dtype=object)
+        offsets = starts + 3 * np.arange(polygons_tot)
+        head = '%s<Polygon> %%d {\n' % padding
+        tokens[offsets] = [head % index for index in
+                           range(first_index, first_index + polygons_tot)]
+        tokens[offsets + 1] = np.array(states, dtype=object)[state_index]
+        loop_slots = np.repeat(offsets + 2 - starts, loop_total)
+        loop_slots += np.arange(loops_tot)
+        tokens[loop_slots] = [index + ' ' for index in
+                              map(str, loop_vertex[loop_order].tolist())]
+        tokens[offsets + 2 + loop_total] = (
+            '<Ref> { %s }\n' % pool_name +
+            '%s  }\n' % padding +
+            '%s}\n' % padding)
+        return ''.join(tokens.tolist())
+
+    def vertex_refs(self, padding, pool_name, memberships):
+        """
+        Render one <VertexRef> per (membership label, vertex indices).
+        """
+        template = ('%s<VertexRef> {\n' % padding +
+                    '%s  %%s\n' % padding +
+                    '%s  <Scalar> membership { %%s }\n' % padding +
+                    '%s  <Ref> { %s }\n' % (padding, pool_name) +
+                    '%s}\n' % padding)
+        indices = self.indices
+        return ''.join([template % (indices(vertex_indices), label)
+                        for label, vertex_indices in memberships])
+
+    def switch_condition(self, padding, switch_in, switch_out):
+        f = self._transform_float
+        return ('%s<SwitchCondition> {\n' % padding +
+                ('%%s  <Distance> { %s %s <Vertex> { 0 0 0 } }\n' % (f, f)) %
+                (padding, switch_in, switch_out) +
+                '%s}\n' % padding)
+
+    def translate(self, padding, loc):
+        f = self._transform_float
+        return ('%s<Translate> { ' % padding +
+                (' %s %s %s }\n' % (f, f, f)) % (loc[0], loc[1], loc[2]))
+
+    def anim_table(self, padding, fps, components):
+        """
+        Render the <Xfm$Anim_S$> table of a joint from its per frame
+        components, (frames, 9) in ANIM_COMPONENTS order. Components
+        at their rest value in every frame are left out, constant ones
+        are written once.
+        """
+        f = self._transform_float
+        text = ('%s<Xfm$Anim_S$> xform {\n' % padding +
+                '%s  <Scalar> fps { %g }\n' % (padding, fps))
+        for column, (name, rest) in enumerate(ANIM_COMPONENTS.items()):
+            labels = [f % value for value in components[:, column].tolist()]
+            if labels.count(labels[0]) == len(labels):
+                if float(labels[0]) == rest:
+                    continue
+                labels = labels[:1]
+            text += ('%s  <S$Anim> %s {\n' % (padding, name) +
+                     '%s    <V> {\n' % padding +
+                     ''.join(['%s      %s\n' % (padding,
+                                                ' '.join(labels[i:i + 8]))
+                              for i in range(0, len(labels), 8)]) +
+                     '%s    }\n' % padding +
+                     '%s  }\n' % padding)
+        return text + '%s}\n' % padding
+
+
+class MeshBlock(object):
+    """
+    The vertex pool and polygons of one mesh with everything needed
+    to render them, taken from Blender on the main thread. It holds no
+    bpy data, so it can be pickled and rendered in another process.
+    """
+    def __init__(self, formatter, pool_name, indent_level, vertex_pool,
+                 slots, weight_comments=True):
+        self.formatter = formatter
+        self.weight_comments = weight_comments
+        self.pool_name = pool_name
+        self.indent_level = indent_level
+        self.co = vertex_pool.co
+        self.normals = vertex_pool.normals
+        self.uvs = vertex_pool.uvs
+        self.vertex_weights = vertex_pool.weights
+        self.loop_start = vertex_pool.loop_start
+        self.loop_total = vertex_pool.loop_total
+        self.loop_vertex = vertex_pool.loop_vertex
+        padding = indent_level*' '
+        # the extra last state covers empty and out of range slots
+        self.states = [formatter.polygon_state(padding, entry)
+                       for entry in slots + [None]]
+        material_index = vertex_pool.material_index
+        self.state_index = np.where(material_index < len(slots),
+                                    material_index, len(slots))
+
+    def vertex_pool(self, step_size):
+        """
+        Yield the <VertexPool> text as (text, vertices) pieces of at
+        most step_size vertices each.
+        """
+        padding = self.indent_level*' '
+        vertex_padding = padding + '  '
+        vertices_tot = len(self.co)
+        yield '%s<VertexPool> %s {\n' % (padding, self.pool_name), 0
+        for start in range(0, vertices_tot, step_size):
+            stop = min(start + step_size, vertices_tot)
+            comments = None
+            if self.weight_comments:
+                comments = self.formatter.weight_comments(
+                    vertex_padding, self.vertex_weights, start, stop)
+            yield self.formatter.vertices(
+                vertex_padding, self.co[start:stop],
+                self.normals[start:stop],
+                None if self.uvs is None else self.uvs[start:stop],
+                comments, first_index=start), stop - start
+        yield '%s}\n' % padding, 0
+
+    def polygons(self, step_size):
+        """
+        Yield the <Polygon> entries as (text, polygons) pieces of at
+        most step_size polygons each.
+        """
+        padding = self.indent_level*' '
+        polygons_tot = len(self.loop_start)
+        for start in range(0, polygons_tot, step_size):
+            stop = min(start + step_size, polygons_tot)
+            yield self.formatter.polygons(
+                padding, self.pool_name, self.states,
+                self.state_index[start:stop], self.loop_start[start:stop],
+                self.loop_total[start:stop], self.loop_vertex,
+                first_index=start), stop - start
+
+    def row_sizes(self, sample=64):
+        """
+        Average text length of a vertex and of a polygon, measured on
+        the first sample of each.
+        """
+        sizes = []
+        for pieces in (self.vertex_pool(sample), self.polygons(sample)):
+            size = 0
+            for text, rows in pieces:
+                if rows:
+                    size = len(text) // rows + 1
+                    break
+            sizes.append(size)
+        return sizes
+
+    def text(self):
+        step_size = max(len(self.co), len(self.loop_start), 1)
+        return ''.join([text for text, _ in self.vertex_pool(step_size)] +
+                       [text for text, _ in self.polygons(step_size)])
+
+
+def _render_mesh_block(block):
+    return block.text()
+
+
+def matrix_array(collection, attr):
+    """
+    Read the 4x4 matrix attr of every item of a bpy collection with a
+    single foreach_get into an (items, 4, 4) array of column vector
+    matrices.
+    """
+    values = np.empty(len(collection) * 16, dtype=np.float32)
+    collection.foreach_get(attr, values)
+    # Blender keeps matrices column by column
+    return values.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+
+
+class SkeletonArrays(object):
+    """
+    Rest pose of an armature, pulled out of Blender in bulk: the bone
+    names with their parent indices (-1 for roots) in armature order,
+    matrix_local as (bones, 4, 4) column vector matrices and head_local
+    as (bones, 3).
+    """
+    def __init__(self, armature):
+        bones = armature.bones
+        self.names = bones.keys()
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.parents = np.array([self.index[bone.parent.name]
+                                 if bone.parent else -1
+                                 for bone in bones], dtype=np.int32)
+        self.matrix_local = matrix_array(bones, 'matrix_local')
+        self.heads = np.empty(len(self.names) * 3, dtype=np.float32)
+        bones.foreach_get('head_local', self.heads)
+        self.heads.shape = (len(self.names), 3)
+
+    def joint_transforms(self, pose):
+        """
+        Return the joint transforms relative to their parents, as
+        (frames, bones, 4, 4) row vector matrices like Panda3D uses,
+        that move the vertices as the pose space matrices pose of the
+        same shape do in Blender. The rest joints of the egg are plain
+        translations to the bone heads, so the net transform of a joint
+        is its pose matrix times the inverse matrix_local times the
+        translation to its head.
+        """
+        frames_tot, bones_tot = pose.shape[:2]
+        rest = np.tile(_Identity, (bones_tot, 1, 1))
+        rest[:, :3, 3] = self.heads
+        offset = np.einsum('bij,bjk->bik', la.inv(self.matrix_local), rest)
+        net = np.einsum('fbij,bjk->fbik', pose, offset)
+        parent_net = np.tile(_Identity, (frames_tot, bones_tot, 1, 1))
+        has_parent = self.parents >= 0
+        parent_net[:, has_parent] = net[:, self.parents[has_parent]]
+        local = np.einsum('fbij,fbjk->fbik', la.inv(parent_net), net)
+        return local.transpose(0, 1, 3, 2)
+
+
+# <S$Anim> components of an <Xfm$Anim_S$> table and their rest values
+ANIM_COMPONENTS = collections.OrderedDict([
+    ('i', 1.0), ('j', 1.0), ('k', 1.0),
+    ('h', 0.0), ('p', 0.0), ('r', 0.0),
+    ('x', 0.0), ('y', 0.0), ('z', 0.0),
+])
+
+
+def decompose_transforms(matrices):
+    """
+    Split row vector matrices (..., 4, 4) without shear into Panda3D's
+    scale, heading, pitch and roll in degrees and translation, returned
+    as an (..., 9) array in ANIM_COMPONENTS order.
+    """
+    upper = matrices[..., :3, :3]
+    scale = np.sqrt((upper ** 2).sum(axis=-1))
+    # a mirroring transform keeps its flip in the x scale
+    scale[..., 0] *= np.where(la.det(upper) < 0.0, -1.0, 1.0)
+    rotation = upper / np.where(scale == 0.0, 1.0, scale)[..., None]
+    # rotation is roll * pitch * heading, about the y, x and z axes
+    sin_pitch = np.clip(rotation[..., 1, 2], -1.0, 1.0)
+    gimbal = np.abs(sin_pitch) > 0.99999
+    heading = np.where(gimbal,
+                       np.arctan2(rotation[..., 0, 1], rotation[..., 0, 0]),
+                       np.arctan2(-rotation[..., 1, 0], rotation[..., 1, 1]))
+    roll = np.where(gimbal, 0.0,
+                    np.arctan2(-rotation[..., 0, 2], rotation[..., 2, 2]))
+    components = np.empty(matrices.shape[:-2] + (9,))
+    components[..., 0:3] = scale
+    components[..., 3] = np.degrees(heading)
+    components[..., 4] = np.degrees(np.arcsin(sin_pitch))
+    components[..., 5] = np.degrees(roll)
+    components[..., 6:9] = matrices[..., 3, :3]
+    return components
+
+
+def _replace_file(temp_path, filepath):
+    # mkstemp creates the file private to the user
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp_path, 0o666 & ~umask)
+    os.replace(temp_path, filepath)
+
+
+def _copy_file_sha1(source, dest, chunk_size=1 << 20):
+    """
+    Copy source to dest through a temporary file and return the sha1
+    hex digest of the content.
+    """
+    sha1 = hashlib.sha1()
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp',
+                                     dir=os.path.dirname(dest))
+    try:
+        with io.open(fd, 'wb') as out_fp, io.open(source, 'rb') as in_fp:
+            chunk = in_fp.read(chunk_size)
+            while chunk:
+                sha1.update(chunk)
+                out_fp.write(chunk)
+                chunk = in_fp.read(chunk_size)
+        _replace_file(temp_path, dest)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return sha1.hexdigest()
+
+
+def _file_sha1(filepath, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with io.open(filepath, 'rb') as fp:
+        chunk = fp.read(chunk_size)
+        while chunk:
+            sha1.update(chunk)
+            chunk = fp.read(chunk_size)
+    return sha1.hexdigest()
+
+
+class EggFileSink(object):
+    """
+    Egg output that goes through a large buffer into a temporary file
+    next to the target, which is renamed over the target by commit().
+    A failed or cancelled export calls abort() and leaves no partial
+    file behind. With compress the text is deflated on the fly into
+    the zlib stream Panda3D reads as .egg.pz.
+    """
+    def __init__(self, filepath, compress=False, buffer_size=1 << 20,
+                 compress_level=6):
+        self.filepath = filepath
+        self.bytes_written = 0
+        dirname, basename = os.path.split(os.path.abspath(filepath))
+        fd, self._temp_path = tempfile.mkstemp(prefix='.%s.' % basename,
+                                               suffix='.tmp', dir=dirname)
+        self._fp = io.open(fd, 'wb', buffering=buffer_size)
+        if compress:
+            self._compressor = zlib.compressobj(compress_level)
+        else:
+            self._compressor = None
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.bytes_written += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        self._fp.write(data)
+
+    def commit(self):
+        if self._compressor:
+            self._fp.write(self._compressor.flush())
+        self._fp.close()
+        _replace_file(self._temp_path, self.filepath)
+
+    def abort(self):
+        self._fp.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+
+class BamFileSink(object):
+    """
+    Spools the egg text into a temporary file next to the target and on
+    commit() loads it with Panda3D's egg loader in this process and
+    writes the resulting node tree as a binary .bam, again through a
+    temporary file that is renamed over the target. Without egg_mesh
+    the loader keeps the triangles in their written order instead of
+    building strips and fans from them. Needs the panda3d modules.
+    """
+    def __init__(self, filepath, buffer_size=1 << 20, egg_mesh=True):
+        if EggData is None:
+            raise ImportError('panda3d is required for .bam output')
+        self.filepath = filepath
+        self.bytes_written = 0
+        self._egg_mesh = egg_mesh
+        dirname, basename = os.path.split(os.path.abspath(filepath))
+        fd, self._egg_path = tempfile.mkstemp(prefix='.%s.' % basename,
+                                              suffix='.egg', dir=dirname)
+        self._fp = io.open(fd, 'wb', buffering=buffer_size)
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.bytes_written += len(data)
+        self._fp.write(data)
+
+    def commit(self):
+        dirname, basename = os.path.split(os.path.abspath(self.filepath))
+        self._fp.close()
+        egg = EggData()
+        try:
+            if not egg.read(Filename.fromOsSpecific(self._egg_path)):
+                raise RuntimeError('Panda3D could not parse the egg data')
+        finally:
+            os.remove(self._egg_path)
+        egg.setEggFilename(Filename.fromOsSpecific(
+            os.path.splitext(self.filepath)[0] + '.egg'))
+        # textures are written relative to the output folder
+        egg.resolveFilenames(DSearchPath(Filename.fromOsSpecific(dirname)))
+        egg_mesh = ConfigVariableBool('egg-mesh')
+        had_local_value = egg_mesh.hasLocalValue()
+        old_value = egg_mesh.getValue()
+        egg_mesh.setValue(self._egg_mesh and old_value)
+        try:
+            node = loadEggData(egg)
+        finally:
+            if had_local_value:
+                egg_mesh.setValue(old_value)
+            else:
+                egg_mesh.clearLocalValue()
+        if node is None:
+            raise RuntimeError('Panda3D could not load the egg data')
+        fd, temp_path = tempfile.mkstemp(prefix='.%s.' % basename,
+                                         suffix='.bam', dir=dirname)
+        os.close(fd)
+        try:
+            if not NodePath(node).writeBamFile(
+                    Filename.fromOsSpecific(temp_path)):
+                raise IOError('Unable to write %s' % temp_path)
+            _replace_file(temp_path, self.filepath)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def abort(self):
+        self._fp.close()
+        try:
+            os.remove(self._egg_path)
+        except OSError:
+            pass
+
+
+class TextureCache(object):
+    """
+    Copies images into texture folders and remembers, in a JSON
+    manifest inside each folder, which source file (path, size, mtime
+    and sha1) every copy was made from, so unchanged textures are
+    skipped on later exports.
+    Images backed by a file on disk are copied byte for byte on a
+    thread pool; packed, generated or modified images are re-encoded
+    with image.save_render on the calling thread, as bpy is not thread
+    safe. A cache may be shared by several exports; wait() finishes the
+    pending copies and saves the manifests.
+    """
+    manifest_name = '.texture_cache.json'
+
+    def __init__(self, persistent=True, max_workers=4):
+        self._persistent = persistent
+        self._max_workers = max_workers
+        self._manifests = {}
+        self._executor = None
+        self._pending = []
+
+    def _manifest(self, folder):
+        manifest = self._manifests.get(folder)
+        if manifest is None:
+            manifest = {}
+            path = os.path.join(folder, self.manifest_name)
+            if self._persistent and os.path.exists(path):
+                try:
+                    with io.open(path, 'r', encoding='utf-8') as fp:
+                        manifest = json.load(fp)
+                except (IOError, OSError, ValueError):
+                    print('Ignoring unreadable texture cache %s' % path)
+            self._manifests[folder] = manifest
+        return manifest
+
+    def _is_current(self, entry, source, stat, newpath):
+        if not entry or entry.get('source') != source:
+            return False
+        try:
+            if os.path.getsize(newpath) != entry.get('dest_size'):
+                return False
+        except OSError:
+            return False
+        if (entry.get('size') == stat.st_size and
+                entry.get('mtime') == stat.st_mtime):
+            return True
+        # touched but maybe not modified, compare the content
+        if entry.get('size') == stat.st_size and entry.get('sha1'):
+            if _file_sha1(source) == entry['sha1']:
+                entry['mtime'] = stat.st_mtime
+                return True
+        return False
+
+    def copy(self, image, newpath):
+        """
+        Bring newpath up to date with image, possibly asynchronously.
+        """
+        folder, name = os.path.split(newpath)
+        manifest = self._manifest(folder)
+        source = os.path.abspath(bpy.path.abspath(image.filepath))
+        plain_copy = (image.source == 'FILE' and
+                      not image.packed_file and
+                      not image.is_dirty and
+                      os.path.isfile(source))
+        if not plain_copy:
+            manifest.pop(name, None)
+            try:
+                image.save_render(newpath)
+            except:
+                print('Unable to copy \'%s\' -> \'%s\'' %
+                      (image.filepath, newpath))
+            return
+        stat = os.stat(source)
+        if self._is_current(manifest.get(name), source, stat, newpath):
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self._max_workers)
+        future = self._executor.submit(_copy_file_sha1, source, newpath)
+        self._pending.append((future, manifest, name, source, stat,
+                              newpath))
+
+    def wait(self):
+        """
+        Wait for the pending copies and save the updated manifests.
+        """
+        for future, manifest, name, source, stat, newpath in self._pending:
+            try:
+                sha1 = future.result()
+            except (IOError, OSError):
+                print('Unable to copy \'%s\' -> \'%s\'' % (source, newpath))
+                manifest.pop(name, None)
+                continue
+            manifest[name] = {'source': source,
+                              'size': stat.st_size,
+                              'mtime': stat.st_mtime,
+                              'sha1': sha1,
+                              'dest_size': stat.st_size}
+        self._pending = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._persistent:
+            for folder, manifest in self._manifests.items():
+                self._save_manifest(folder, manifest)
+
+    def _save_manifest(self, folder, manifest):
+        path = os.path.join(folder, self.manifest_name)
+        try:
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=folder)
+            with io.open(fd, 'w', encoding='utf-8') as fp:
+                fp.write(json.dumps(manifest, indent=1, sort_keys=True))
+            _replace_file(temp_path, path)
+        except (IOError, OSError):
+            print('Unable to save texture cache %s' % path)
+
+
+def fingerprint(*parts):
+    """
+    sha1 hex digest of strings, numbers, NumPy arrays and nested
+    lists/tuples of them.
+    """
+    sha1 = hashlib.sha1()
+
+    def update(part):
+        if isinstance(part, np.ndarray):
+            sha1.update(('%s%r' % (part.dtype.str, part.shape)).encode())
+            sha1.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (list, tuple)):
+            sha1.update(('[%d' % len(part)).encode())
+            for item in part:
+                update(item)
+        else:
+            sha1.update(('%r;' % (part,)).encode('utf-8'))
+
+    update(parts)
+    return sha1.hexdigest()
+
+
+class BlockCache(object):
+    """
+    Serialized egg blocks keyed by a fingerprint of everything they
+    are rendered from, kept in a sidecar file: a JSON line listing the
+    keys and sizes, followed by every block compressed on its own with
+    zlib. The sidecar is opened on first use and a block only
+    decompressed when it is reused, and reused blocks are saved back
+    without compressing them again. Only the blocks used by the last
+    export are saved, and nothing is saved when those are exactly the
+    blocks already in the file.
+    """
+    version = 2
+
+    def __init__(self, path, level=1):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._level = level
+        self._index = None
+        self._used = collections.OrderedDict()
+        self._changed = False
+
+    def _load(self):
+        # key -> (offset, size) of the compressed block in the file
+        self._index = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with io.open(self.path, 'rb') as fp:
+                header = json.loads(fp.readline().decode('utf-8'))
+                offset = fp.tell()
+            if header.get('version') != self.version:
+                return
+            for key, size in header['blocks']:
+                self._index[key] = (offset, size)
+                offset += size
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self._index = {}
+            print('Ignoring unreadable block cache %s' % self.path)
+
+    def _read(self, key):
+        offset, size = self._index[key]
+        try:
+            with io.open(self.path, 'rb') as fp:
+                fp.seek(offset)
+                data = fp.read(size)
+            return data, zlib.decompress(data).decode('utf-8')
+        except (IOError, OSError, ValueError, zlib.error):
+            print('Ignoring unreadable block cache %s' % self.path)
+            self._index = {}
+            return None, None
+
+    def __contains__(self, key):
+        if self._index is None:
+            self._load()
+        return key in self._index
+
+    def get(self, key):
+        text = None
+        if key in self:
+            data, text = self._read(key)
+        if text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._used[key] = data
+        return text
+
+    def put(self, key, text):
+        self._used[key] = zlib.compress(text.encode('utf-8'), self._level)
+        self._changed = True
+
+    def save(self):
+        if self._index is None:
+            self._load()
+        if not self._changed and set(self._used) == set(self._index):
+            return
+        header = json.dumps({'version': self.version,
+                             'blocks': [[key, len(data)] for key, data
+                                        in self._used.items()]})
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+            with io.open(fd, 'wb') as fp:
+                fp.write(header.encode('utf-8') + b'\n')
+                for data in self._used.values():
+                    fp.write(data)
+            _replace_file(temp_path, self.path)
+        except (IOError, OSError):
+            print('Unable to save block cache %s' % self.path)
+
+
+class _TextRecorder(object):
+    """
+    Passes writes on to a sink and keeps a copy of the text, up to
+    limit characters when given; the copy of a longer text is dropped
+    and overflow set.
+    """
+    def __init__(self, sink, limit=0):
+        self._sink = sink
+        self._limit = limit
+        self._size = 0
+        self.overflow = False
+        self.chunks = []
+
+    @property
+    def bytes_written(self):
+        return self._sink.bytes_written
+
+    def write(self, text):
+        if not self.overflow:
+            self._size += len(text)
+            if self._limit and self._size > self._limit:
+                self.overflow = True
+                self.chunks = []
+            else:
+                self.chunks.append(text)
+        self._sink.write(text)
+
+
+def _max_rss():
+    """
+    Peak resident set size of the process in bytes, or None.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if platform.system() == 'Darwin' else max_rss * 1024
+
+
+class _StageClock(object):
+    """
+    Running time of a stage, paused while a stepped export is suspended.
+    """
+    def __init__(self):
+        self.seconds = 0.0
+        self._start = time.perf_counter()
+
+    def pause(self):
+        if self._start is not None:
+            self.seconds += time.perf_counter() - self._start
+            self._start = None
+
+    def resume(self):
+        if self._start is None:
+            self._start = time.perf_counter()
+
+    def stop(self):
+        self.pause()
+        return self.seconds
+
+
+class ExportStats(object):
+    """
+    Wall time, output bytes and memory per export stage plus item
+    counts, reported as a JSON serializable dict.
+    Nested entries of a stage that is already running (the recursive
+    joint writer) count as calls but are timed once. With track_memory
+    the peak Python heap is traced per stage through tracemalloc, which
+    slows the export down. Time spent while a stepped export is
+    suspended between steps is not counted.
+    """
+    def __init__(self, track_memory=False):
+        self.stages = collections.OrderedDict()
+        self.counts = collections.Counter()
+        self.seconds = None
+        self.peak_python_memory = None
+        self._track_memory = track_memory
+        self._depth = collections.Counter()
+        self._peaks = []
+        self._top_peak = 0
+        self._clock = None
+
+    def _tracing(self):
+        return (self._track_memory and tracemalloc.is_tracing() and
+                hasattr(tracemalloc, 'reset_peak'))
+
+    def start(self):
+        self._clock = _StageClock()
+        if self._track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def pause(self):
+        self._clock.pause()
+
+    def resume(self):
+        self._clock.resume()
+
+    def stop(self):
+        self.seconds = self._clock.stop()
+        if self._track_memory and tracemalloc.is_tracing():
+            self.peak_python_memory = max(tracemalloc.get_traced_memory()[1],
+                                          self._top_peak)
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name, sink=None):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = {'seconds': 0.0, 'calls': 0, 'bytes_written': 0}
+            self.stages[name] = entry
+        entry['calls'] += 1
+        self._depth[name] += 1
+        if self._depth[name] > 1:
+            try:
+                yield _StageClock()
+            finally:
+                self._depth[name] -= 1
+            return
+        start_bytes = getattr(sink, 'bytes_written', 0)
+        tracing = self._tracing()
+        if tracing:
+            # the heap peak so far belongs to the enclosing stage
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1],
+                                      tracemalloc.get_traced_memory()[1])
+            self._peaks.append(0)
+            tracemalloc.reset_peak()
+        clock = _StageClock()
+        try:
+            yield clock
+        finally:
+            self._depth[name] -= 1
+            entry['seconds'] += clock.stop()
+            entry['bytes_written'] += (getattr(sink, 'bytes_written', 0) -
+                                       start_bytes)
+            if tracing:
+                peak = max(self._peaks.pop(),
+                           tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                else:
+                    self._top_peak = max(self._top_peak, peak)
+                entry['peak_python_memory'] = max(
+                    entry.get('peak_python_memory', 0), peak)
+            max_rss = _max_rss()
+            if max_rss is not None:
+                entry['max_rss'] = max_rss
+
+    def count(self, name, number=1):
+        self.counts[name] += number
+
+    def report(self):
+        report = {'seconds': self.seconds,
+                  'max_rss': _max_rss(),
+                  'stages': self.stages,
+                  'counts': dict(self.counts)}
+        if self.peak_python_memory is not None:
+            report['peak_python_memory'] = self.peak_python_memory
+        return report
+
+
+def export_stage(name):
+    """
+    Record the decorated ExportEggWorker method as stage name. A
+    generator method is timed while it runs, not while it is suspended.
+    """
+    def decorator(method):
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def staged_steps(self, *args, **kwargs):
+                steps = method(self, *args, **kwargs)
+                try:
+                    with self._stats.stage(name, self._egg_fp) as clock:
+                        for step in steps:
+                            clock.pause()
+                            yield step
+                            clock.resume()
+                finally:
+                    steps.close()
+            return staged_steps
+
+        @functools.wraps(method)
+        def staged(self, *args, **kwargs):
+            with self._stats.stage(name, self._egg_fp):
+                return method(self, *args, **kwargs)
+        return staged
+    return decorator
+
+
 class ExportEggWorker(object):
-    def __init__(self, human, weight_precision, filepath, use_rel_paths):
+    """
+    Exports one character, or a list of characters into one egg with a
+    group per character and every material and texture written once.
+    """
+    def __init__(self, human, weight_precision, filepath, use_rel_paths,
+                 vertex_precision=4, compress=False, output_format='EGG',
+                 texture_cache=None, material_index=None,
+                 incremental=False, report=False, track_memory=False,
+                 step_size=10000, processes=0, split_seams=True,
+                 max_influences=0, min_weight=0.0, prune_joints=False,
+                 weight_comments=True,
+                 optimize_vertex_cache=False, lod_levels=0,
+                 lod_distance=10.0, animations='NONE',
+                 separate_animations=False, frame_chunk=256,
+                 memory_limit=0):
         self._use_rel_paths = True
-        self._human = human
+        self._formatter = EggFormatter(vertex_precision=int(vertex_precision))
+        if isinstance(human, (list, tuple)):
+            self._humans = list(human)
+        else:
+            self._humans = [human]
+        self._human = self._humans[0]
         self._vertex_weight_precision = '{0:.' + str(weight_precision) + 'f}'
         self._copied_files = {}
+        if texture_cache is None:
+            texture_cache = TextureCache()
+        self._texture_cache = texture_cache
+        self._vertex_weights = {}
+        self._mesh_arrays = {}
+        self._vertex_pools = {}
+        self._pool_weights = {}
+        self._split_seams = split_seams
+        self._max_influences = int(max_influences)
+        self._min_weight = float(min_weight)
+        self._prune_joints = prune_joints
+        self._pruned_joints = set()
+        self._weight_comments = weight_comments
+        self._optimize_vertex_cache = optimize_vertex_cache
+        self._lod_levels = int(lod_levels)
+        self._lod_distance = float(lod_distance)
+        self._animations = animations
+        self._separate_animations = separate_animations
+        self._frame_chunk = frame_chunk
+        self._skeleton_arrays = None
+        if material_index is None:
+            material_index = MaterialIndex()
+        self._material_index = material_index
         self._egg_fp = None
+        self._step_size = step_size
+        # MiB; bounds the text buffered at once, 0 for no bound
+        self._memory_limit = int(memory_limit) * 2**20
+        self._processes = processes
+        self._mesh_pool = None
+        self._mesh_futures = {}
+        self._work_done = 0
+        self._work_total = 0
+        self._joint_work = 0
+        self.result = None
+        self._stats = ExportStats(track_memory)
+        self._write_report = report
+        self._compress = compress
+        self._output_format = output_format
         self._tex_folder = None
         self._outFolder = ''
         self._separate_tex_folder = 'textures'
         self._filepath = filepath
         self._filename = good_file_name(filepath)
+        self._group_name = self._filename
+        if incremental:
+            self._block_cache = BlockCache(filepath + '.blocks')
+        else:
+            self._block_cache = None
         self._setup_tex_folder()
         return None
 
@@ -112,22 +1861,12 @@ class ExportEggWorker(object):
         self._outFolder = os.path.realpath(os.path.dirname(self._filepath))
         self._tex_folder = self._get_sub_folder()
 
-    def _copy_texture_to_new_location(self, image):
-        filepath = image.filepath
-        filename = os.path.basename(filepath)
-
-        newpath = os.path.abspath(os.path.join(self._tex_folder, filename))
-        try:
-            self._copied_files[filepath]
-            done = True
-        except:
-            done = False
-        if not done:
-            try:
-                image.save_render(newpath)
-            except:
-                print('Unable to copy \'%s\' -> \'%s\'' % (filepath, newpath))
-            self._copied_files[filepath] = True
+    def _copy_texture_to_new_location(self, texture):
+        newpath = os.path.abspath(os.path.join(self._tex_folder,
+                                               texture.filename))
+        if newpath not in self._copied_files:
+            self._texture_cache.copy(texture.image, newpath)
+            self._copied_files[newpath] = True
 
         if self._use_rel_paths:
             relpath = os.path.relpath(newpath, self._outFolder)
@@ -135,22 +1874,14 @@ class ExportEggWorker(object):
         else:
             return newpath
 
+    @export_stage('textures')
     def _write_textures(self, rmeshes):
-        for rmesh in rmeshes:
-            materials = rmesh.data.materials
-            for mat in materials:
-                if mat:
-                    imageTextures = [(tslot.texture,
-                                      tslot.texture_coords, tslot.mapping)
-                                     for tslot in mat.texture_slots.values()
-                                     if tslot is not None and
-                                     tslot.texture.type == 'IMAGE' and
-                                     getattr(tslot.texture.image, 'source',
-                                             '') == 'FILE']
-                    for (texture, texture_coords, mapping) in imageTextures:
-                        if texture.image.filepath not in self._copied_files:
-                            self._write_texture(texture, texture_coords,
-                                                mapping)
+        written = set()
+        for entry in self._material_index.used_entries(rmeshes):
+            for texture in entry.image_textures:
+                if texture.name not in written:
+                    written.add(texture.name)
+                    self._write_texture(texture)
 
     def _get_image_format(self, image):
         colorspaceName = image.colorspace_settings.name
@@ -190,31 +1921,30 @@ class ExportEggWorker(object):
                    'and mapping=%s' % mapping)
             return 'undefined'
 
-    def _write_texture(self, texture, texture_coords, mapping):
-        if not texture:
-            return
-        image = texture.image
-        if not image:
-            return
-        newpath = self._copy_texture_to_new_location(image)
-        texname = good_texture_name(image.filepath)
+    def _write_texture(self, entry):
+        texture = entry.texture
+        image = entry.image
+        newpath = self._copy_texture_to_new_location(entry)
+        self._stats.count('textures')
         self._egg_fp.write(
-            '<Texture> %s {\n' % texname +
+            '<Texture> %s {\n' % entry.name +
             '  "%s"\n' % newpath +
             '  <Scalar> format { %s }\n' % self._get_image_format(image) +
             '  <Scalar> wrapu { %s }\n' % self._get_texture_wrap_u(texture) +
             '  <Scalar> wrapv { %s }\n' % self._get_texture_wrap_v(texture) +
-            '  <Scalar> type { %s }\n' % self._get_texture_type(texture_coords,
-                                                                mapping) +
+            '  <Scalar> type { %s }\n' % self._get_texture_type(
+                entry.texture_coords, entry.mapping) +
             '}\n\n'
         )
 
+    @export_stage('materials')
     def _write_materials(self, rmeshes):
-        for rmesh in rmeshes:
-            mat = rmesh.active_material
-            material_name = good_material_name(mat.name)
+        # every slot material of every mesh, each distinct one once
+        for entry in self._material_index.used_entries(rmeshes):
+            mat = entry.material
+            self._stats.count('materials')
             self._egg_fp.write(
-                '<Material> %s {\n' % material_name +
+                '<Material> %s {\n' % entry.name +
                 '  <Scalar> diffr { %.4f }\n' % mat.diffuse_color.r +
                 '  <Scalar> diffg { %.4f }\n' % mat.diffuse_color.g +
                 '  <Scalar> diffb { %.4f }\n' % mat.diffuse_color.b +
@@ -231,83 +1961,219 @@ class ExportEggWorker(object):
                 '  <Scalar> shininess { %.4f }\n' % mat.specular_hardness +
                 '}\n\n')
 
-    def _mesh_to_weight_dict(self, mesh_obj):
+    def _get_vertex_weights(self, mesh_obj):
+        """
+        Return the VertexWeights of a mesh object, built once per export
+        and shared by the vertex pool and the armature.
+        """
+        weights = self._vertex_weights.get(mesh_obj.name)
+        if weights is None:
+            with self._stats.stage('extract_weights'):
+                weights = VertexWeights(mesh_obj,
+                                        self._vertex_weight_precision)
+            self._stats.count('weights', len(weights.weights))
+            if self._max_influences or self._min_weight > 0.0:
+                weights_tot = len(weights.weights)
+                with self._stats.stage('limit_weights'):
+                    weights = weights.limited(
+                        self._max_influences, self._min_weight,
+                        set(self._human.data.bones.keys()))
+                self._stats.count('dropped_weights',
+                                  weights_tot - len(weights.weights))
+            self._vertex_weights[mesh_obj.name] = weights
+        return weights
+
+    def _get_mesh_arrays(self, mesh_obj):
+        arrays = self._mesh_arrays.get(mesh_obj.name)
+        if arrays is None:
+            with self._stats.stage('extract_arrays'):
+                arrays = MeshArrays(mesh_obj.data)
+            self._mesh_arrays[mesh_obj.name] = arrays
+        return arrays
+
+    def _get_vertex_pool(self, mesh_obj, lod=0):
+        """
+        Return the VertexPool of a mesh object at a level of detail, each
+        level halving the vertices of the level before.
+        """
+        pool = self._vertex_pools.get((mesh_obj.name, lod))
+        if pool is None and lod:
+            with self._stats.stage('lod'):
+                pool = self._get_vertex_pool(mesh_obj).decimated(0.5 ** lod)
+            if self._optimize_vertex_cache:
+                with self._stats.stage('vertex_cache'):
+                    pool.optimize_vertex_cache()
+            self._vertex_pools[(mesh_obj.name, lod)] = pool
+            self._pool_weights[(mesh_obj.name, lod)] = pool.weights
+        elif pool is None:
+            arrays = self._get_mesh_arrays(mesh_obj)
+            weights = self._get_vertex_weights(mesh_obj)
+            with self._stats.stage('split_seams'):
+                pool = VertexPool(arrays, weights, self._split_seams,
+                                  self._formatter.vertex_precision)
+            self._stats.count('split_vertices', len(pool.co) - len(arrays.co))
+            if self._optimize_vertex_cache:
+                with self._stats.stage('vertex_cache'):
+                    pool.optimize_vertex_cache()
+            self._vertex_pools[(mesh_obj.name, lod)] = pool
+            self._pool_weights[(mesh_obj.name, lod)] = pool.weights
+        return pool
+
+    def _get_pool_weights(self, mesh_obj, lod=0):
+        """
+        Return the VertexWeights of a vertex pool, which outlive the
+        pool when its mesh is released.
+        """
+        weights = self._pool_weights.get((mesh_obj.name, lod))
+        if weights is None:
+            weights = self._get_vertex_pool(mesh_obj, lod).weights
+        return weights
+
+    def _release_mesh(self, mesh_obj, lod=0):
         """
-        Takes a mesh and return its group names and a dict of dicts,
-        one dict per vertex.
-        aligning the each vert dict with the group names,
-        each dict contains float value for the weight.
+        Drop the arrays and weights of a mesh object once a level of
+        detail is written, and the vertex pool of that level. The full
+        detail pool stays until the last level is decimated from it.
         """
-        group_names = [g.name for g in mesh_obj.vertex_groups]
-        group_names_tot = len(group_names)
+        self._mesh_arrays.pop(mesh_obj.name, None)
+        self._vertex_weights.pop(mesh_obj.name, None)
+        if lod:
+            self._vertex_pools.pop((mesh_obj.name, lod), None)
+        if lod == self._lod_levels:
+            self._vertex_pools.pop((mesh_obj.name, 0), None)
+
+    def _pool_name(self, mesh_obj, lod=0):
+        name = '%s_Mesh' % good_mesh_name(mesh_obj.data.name)
+        if len(self._humans) > 1:
+            # characters often share their mesh names
+            name = '%s_%s' % (self._group_name, name)
+        if lod:
+            name += '_LOD%d' % lod
+        return name
+
+    def _write_cached(self, key, steps):
+        """
+        Run the writer generator steps, or with incremental export write
+        the text a previous export rendered for the same key instead.
+        """
+        if self._block_cache is None:
+            yield from steps
+            return
+        text = self._block_cache.get(key)
+        if text is not None:
+            steps.close()
+            self._egg_fp.write(text)
+            self._stats.count('reused_blocks')
+            return
+        sink = self._egg_fp
+        recorder = self._egg_fp = _TextRecorder(sink,
+                                                self._memory_limit // 4)
+        try:
+            yield from steps
+        finally:
+            self._egg_fp = sink
+        if not recorder.overflow:
+            self._block_cache.put(key, ''.join(recorder.chunks))
+
+    def _formatter_fingerprint(self):
+        fmt = self._formatter
+        return (fmt.vertex_precision, fmt.comment_precision,
+                fmt.transform_precision, self._vertex_weight_precision,
+                self._split_seams, self._max_influences, self._min_weight,
+                self._prune_joints, self._weight_comments,
+                self._optimize_vertex_cache, self._lod_levels)
+
+    def _mesh_fingerprint(self, mesh_obj, indent_level, lod=0):
         mesh = mesh_obj.data
-        weight_dict = {}
-        if not group_names_tot:
-            # no verts? return empty dictionary
-            return group_names, weight_dict
-        for v in mesh.vertices:
-            for g in v.groups:
-                # possible weights are out of range
-                g_index = g.group
-                if g_index < group_names_tot:
-                    if v.index in weight_dict:
-                        weight_dict[v.index][g_index] = g.weight
-                    else:
-                        weight_dict[v.index] = {}
-                        weight_dict[v.index][g_index] = g.weight
-        return group_names, weight_dict
-
-    def _meshes_to_weight_dict(self):
-        mesh_names = [child.name
-                      for child in self._human.children
-                      if child.type == 'MESH']
-        bone_weight_dict = {bone.name: {} for bone in self._human.data.bones}
-        for bone in self._human.data.bones:
-            for mesh_name in mesh_names:
-                bone_weight_dict[bone.name][mesh_name] = {}
-        for mesh_name in mesh_names:
-            mesh = bpy.data.objects[mesh_name]
-            group_names, weight_dict = self._mesh_to_weight_dict(mesh)
-            for v_index in weight_dict:
-                v_groups = weight_dict[v_index]
-                for g_index in v_groups:
-                    weight = v_groups[g_index]
-                    bone_name = group_names[g_index]
-                    weight_str = self._vertex_weight_precision.format(weight)
-                    weights = bone_weight_dict[bone_name][mesh_name]
-                    if weight != 0.0:
-                        if weight_str not in weights:
-                            weights[weight_str] = [v_index]
-                        else:
-                            weights[weight_str].append(v_index)
-        return bone_weight_dict
+        arrays = self._get_mesh_arrays(mesh_obj)
+        weights = self._get_vertex_weights(mesh_obj)
+        slots = [(entry.name, entry.texture_names) if entry else None
+                 for entry in self._material_index.mesh_slots(mesh)]
+        return fingerprint(
+            mesh_obj.name, mesh.name, self._pool_name(mesh_obj, lod),
+            indent_level, lod,
+            self._formatter_fingerprint(), slots,
+            arrays.co, arrays.normals, arrays.uv, arrays.loop_vertex,
+            arrays.loop_start, arrays.loop_total, arrays.material_index,
+            weights.group_names, weights.indptr, weights.groups,
+            weights.weights)
+
+    def _armature_fingerprint(self, meshes_weights, indent_level):
+        bones = [(bone.name, bone.parent.name if bone.parent else None,
+                  tuple(bone.head_local))
+                 for bone in self._human.data.bones]
+        weights = [(pool_name, vertex_weights.group_names,
+                    vertex_weights.groups, vertex_weights.weights,
+                    vertex_weights.vertices)
+                   for pool_name, vertex_weights in meshes_weights]
+        return fingerprint(indent_level, self._formatter_fingerprint(),
+                           bones, weights)
 
+    @export_stage('armature')
     def _write_armature(self, meshes, name, indent_level=0):
         padding = indent_level*' '
         skel = self._human.data
-        bone_weight_dict = self._meshes_to_weight_dict()
+        meshes_weights = [(self._pool_name(mesh, lod),
+                           self._get_pool_weights(mesh, lod))
+                          for mesh in sorted(meshes, key=lambda m: m.name)
+                          for lod in range(self._lod_levels + 1)]
         roots = [bone
                  for bone in skel.bones
                  if bone.parent is None]
-        self._write_bone(roots[0], bone_weight_dict, indent_level)
+        if self._prune_joints:
+            self._pruned_joints = self._unused_joints(roots[0],
+                                                      meshes_weights)
+            self._stats.count('pruned_joints', len(self._pruned_joints))
+        steps = self._write_bone(roots[0], meshes_weights, indent_level)
+        if self._block_cache is None:
+            yield from steps
+        else:
+            key = 'armature:' + self._armature_fingerprint(meshes_weights,
+                                                           indent_level)
+            yield from self._write_cached(key, steps)
+
+    def _unused_joints(self, root, meshes_weights):
+        """
+        Return the names of the bones below root whose whole subtree has
+        no vertex memberships.
+        """
+        used = set()
+        for _, vertex_weights in meshes_weights:
+            groups = np.unique(
+                vertex_weights.groups[vertex_weights.weights != 0.0])
+            used.update(vertex_weights.group_names[g]
+                        for g in groups.tolist())
+        unused = set()
 
-    def _write_bone_vertex_ref(self, meshes_weights, indent_level):
+        def collect(bone):
+            empty = bone.name not in used
+            for child in bone.children:
+                empty = collect(child) and empty
+            if empty:
+                unused.add(bone.name)
+            return empty
+        collect(root)
+        unused.discard(root.name)
+        return unused
+
+    def _write_bone_vertex_ref(self, bone_name, meshes_weights,
+                               indent_level):
         padding = indent_level*' '
-        for mesh_name in sorted(meshes_weights):
-            weights_dict = meshes_weights[mesh_name]
-            meshName = good_mesh_name(mesh_name)
-            for weight in sorted(weights_dict):
-                vertex_indices = weights_dict[weight]
-                self._egg_fp.write('%s<VertexRef> {\n' % padding +
-                                   '%s  ' % padding)
-                for vertex_index in sorted(vertex_indices):
-                    self._egg_fp.write('%d ' % vertex_index)
-                self._egg_fp.write(
-                    '\n%s  <Scalar> membership { %s }\n' % (padding, weight) +
-                    '%s  <Ref> { %s_Mesh }\n' % (padding, meshName) +
-                    '%s}\n' % padding)
+        for pool_name, vertex_weights in meshes_weights:
+            g_index = vertex_weights.group_index(bone_name)
+            if g_index is None:
+                continue
+            memberships = vertex_weights.memberships(g_index)
+            self._stats.count('vertex_refs', len(memberships))
+            self._stats.count('joint_memberships',
+                              sum(len(vertex_indices)
+                                  for _, vertex_indices in memberships))
+            self._egg_fp.write(self._formatter.vertex_refs(
+                padding, pool_name, memberships))
 
-    def _write_bone(self, bone, bones_weights, indent_level=0):
+    @export_stage('joints')
+    def _write_bone(self, bone, meshes_weights, indent_level=0):
+        self._stats.count('joints')
         bname = good_bone_name(bone.name)
         padding = indent_level*' '
         self._egg_fp.write('%s<Joint> %s {\n' % (padding, bname) +
@@ -316,166 +2182,563 @@ class ExportEggWorker(object):
         self._write_bone_translation(bone, indent_level+4)
         self._egg_fp.write('%s  }\n' % padding)
         for child_bone in bone.children:
-            self._write_bone(child_bone, bones_weights, indent_level+2)
-        self._write_bone_vertex_ref(bones_weights[bone.name], indent_level+2)
+            if child_bone.name in self._pruned_joints:
+                continue
+            yield from self._write_bone(child_bone, meshes_weights,
+                                        indent_level+2)
+        self._write_bone_vertex_ref(bone.name, meshes_weights,
+                                    indent_level+2)
         self._egg_fp.write('%s}\n' % padding)
+        self._advance(self._joint_work)
+        yield
 
-    def _write_vertex(self, vertex, indent_level, bvertex, uv_layer, mesh,
-                      group_names, weights):
-        padding = indent_level*' '
-        uv_first = self._uv_from_vert_first(uv_layer, bvertex)
-        uv_set = self._uv_from_vert_set(uv_layer, bvertex, mesh)
-        self._egg_fp.write('%s<Vertex> %d {\n' % (padding, vertex.index) +
-                           '%s  %.4f ' % (padding, vertex.co[0]) +
-                           '%.4f %.4f\n' % (vertex.co[1], vertex.co[2])
-                           )
-        self._egg_fp.write('%s  <UV> { ' % padding +
-                           '%.4f %.4f }\n' % (uv_first[0], uv_first[1]))
-        self._egg_fp.write('%s  <Normal> { ' % padding +
-                           '%.4f ' % vertex.normal[0] +
-                           '%.4f ' % vertex.normal[1] +
-                           '%.4f }\n' % vertex.normal[2])
-        for index, weight in weights.items():
-            bname = good_bone_name(group_names[index])
-            if weight != 0.0:
-                self._egg_fp.write('%s  // %s:' % (padding, bname) +
-                                   '%.8f\n' % weight)
-        self._egg_fp.write('%s}\n' % padding)
+    @export_stage('meshes')
+    def _write_mesh_object(self, mesh_obj, indent_level=0, lod=0):
+        steps = self._write_mesh_group(mesh_obj, indent_level, lod)
+        if self._block_cache is None:
+            yield from steps
+        else:
+            key = 'mesh:' + self._mesh_fingerprint(mesh_obj, indent_level,
+                                                   lod)
+            yield from self._write_cached(key, steps)
 
-    def _uv_from_vert_first(self, uv_layer, v):
-        for link_loop in v.link_loops:
-            uv_data = link_loop[uv_layer]
-            return uv_data.uv
-        return None
+    def _mesh_block(self, mesh_obj, indent_level=0, lod=0):
+        return MeshBlock(self._formatter, self._pool_name(mesh_obj, lod),
+                         indent_level+4, self._get_vertex_pool(mesh_obj, lod),
+                         self._material_index.mesh_slots(mesh_obj.data),
+                         self._weight_comments)
+
+    def _open_mesh_pool(self, blocks_tot):
+        """
+        With more than one process, fork the mesh processes before the
+        texture copy threads start.
+        """
+        if self._processes < 2 or blocks_tot < 2:
+            return
+        try:
+            self._mesh_pool = fork_process_pool(min(self._processes,
+                                                    blocks_tot))
+        except (OSError, ValueError, NotImplementedError,
+                concurrent.futures.process.BrokenProcessPool) as e:
+            print('Unable to start mesh processes: %s' % e)
+            self._close_mesh_pool()
+
+    def _close_mesh_pool(self):
+        self._stop_mesh_pool()
+        if self._mesh_pool is not None:
+            self._mesh_pool.shutdown(wait=False)
+            self._mesh_pool = None
+
+    def _start_mesh_pool(self, meshes, indent_level):
+        """
+        With the process pool open, render the mesh blocks of every
+        level of detail that are not reused from the block cache in it
+        while the main process writes them out in order.
+        """
+        if self._mesh_pool is None:
+            return
+        blocks = []
+        text_size = 0
+        for lod, mesh in itertools.product(range(self._lod_levels + 1),
+                                           meshes):
+            if self._block_cache is not None:
+                key = 'mesh:' + self._mesh_fingerprint(mesh, indent_level,
+                                                       lod)
+                if key in self._block_cache:
+                    continue
+            block = self._mesh_block(mesh, indent_level, lod)
+            if self._memory_limit:
+                # rendered texts wait in memory until written, the
+                # blocks past half the limit are rendered here
+                vertex_size, polygon_size = block.row_sizes()
+                text_size += (len(block.co) * vertex_size +
+                              len(block.loop_start) * polygon_size)
+                if text_size > self._memory_limit // 2:
+                    break
+            blocks.append(((mesh.name, lod), block))
+        if len(blocks) < 2:
+            return
+        try:
+            for key, block in blocks:
+                self._mesh_futures[key] = self._mesh_pool.submit(
+                    _render_mesh_block, block)
+        except (OSError, RuntimeError,
+                concurrent.futures.process.BrokenProcessPool) as e:
+            print('Unable to use mesh processes: %s' % e)
+            self._close_mesh_pool()
+
+    def _stop_mesh_pool(self):
+        for future in self._mesh_futures.values():
+            future.cancel()
+        self._mesh_futures = {}
+
+    def _mesh_text(self, future):
+        try:
+            return future.result()
+        except (concurrent.futures.process.BrokenProcessPool,
+                pickle.PicklingError) as e:
+            print('Mesh processes failed, rendering meshes here: %s' % e)
+            self._close_mesh_pool()
+            return None
 
-    def _uv_from_vert_set(self, uv_layer, bvertex, mesh):
-        uv_set = []
-        for loop in bvertex.link_loops:
-            if loop[uv_layer].uv not in uv_set:
-                uv_set.append(loop[uv_layer].uv)
-        mat = mesh.materials[loop.face.material_index]
-        material_name = good_material_name(mat.name)
-        texture_names = [good_texture_name(texture_slot.texture.image.filepath)
-                         for texture_slot in mat.texture_slots.values()
-                         if texture_slot is not None and
-                         texture_slot.texture.type == 'IMAGE']
-        tex_uv = []
-        if len(texture_names) == 1 and len(uv_set) == 1:
-            tex_uv = [(texture_names[0], uv_set[0])]
-        elif len(texture_names) == 1:
-            tex_uv = [(texture_names[0], uv) for uv in uv_set]
-        elif len(uv_set) == 1:
-            tex_uv = [(tex, uv_set[0]) for tex in texture_names]
-        return tex_uv
-
-    def _write_mesh_object(self, mesh_obj, indent_level=0):
+    def _write_mesh_group(self, mesh_obj, indent_level=0, lod=0):
         padding = indent_level*' '
-        mesh_name = good_mesh_name(mesh_obj.name)
-        self._egg_fp.write('%s  <Group> %s_Mesh {\n' % (padding, mesh_name))
-        self._write_vertexPool(mesh_obj, indent_level+4)
-        self._write_polygons(mesh_obj.data, indent_level+4)
+        group_name = '%s_Mesh' % good_mesh_name(mesh_obj.name)
+        if lod:
+            group_name += '_LOD%d' % lod
+        self._egg_fp.write('%s  <Group> %s {\n' % (padding, group_name))
+        future = self._mesh_futures.pop((mesh_obj.name, lod), None)
+        text = None
+        if future is not None:
+            while not future.done():
+                # keeps a modal export responsive while waiting
+                concurrent.futures.wait([future], timeout=0.1)
+                yield
+            text = self._mesh_text(future)
+        if text is None:
+            block = self._mesh_block(mesh_obj, indent_level, lod)
+            yield from self._write_vertexPool(block)
+            yield from self._write_polygons(block)
+        else:
+            pool = self._get_vertex_pool(mesh_obj, lod)
+            self._stats.count('vertices', len(pool.co))
+            self._stats.count('polygons', len(pool.loop_start))
+            self._egg_fp.write(text)
         self._egg_fp.write('%s  }\n' % padding)
 
-    def _write_vertexPool(self, mesh_obj, indent_level=0):
-        padding = indent_level*' '
-        mesh = mesh_obj.data
-        mesh_name = good_mesh_name(mesh.name)
-        self._egg_fp.write('%s<VertexPool> %s_Mesh {\n' % (padding, mesh_name))
-        group_names, weight_dict = self._mesh_to_weight_dict(mesh_obj)
-        bm = bmesh.new()   # create an empty BMesh
-        bm.from_mesh(mesh)
-        bm.verts.ensure_lookup_table()
-        uv_layer = bm.loops.layers.uv.active
-        for vertex in mesh.vertices:
-            self._write_vertex(vertex, indent_level+2, bm.verts[vertex.index],
-                               uv_layer, mesh, group_names,
-                               weight_dict[vertex.index])
-        bm.free()
-        self._egg_fp.write('%s}\n' % padding)
+    def _step_sizes(self, block):
+        """
+        Return the vertices and the polygons formatted per step. With a
+        memory limit, a step is kept to an eighth of it, counting four
+        times its text for the formatting.
+        """
+        if not self._memory_limit:
+            return self._step_size, self._step_size
+        budget = self._memory_limit // 8
+        return [max(1, min(self._step_size, budget // (4 * size)))
+                if size else self._step_size
+                for size in block.row_sizes()]
 
-    def _write_polygons(self, mesh, indent_level=0):
-        padding = indent_level*' '
-        mesh_name = good_mesh_name(mesh.name)
-        for poly in mesh.polygons:
-            mat = mesh.materials[poly.material_index]
-            material_name = good_material_name(mat.name)
-            texture_names = [good_texture_name(tslot.texture.image.filepath)
-                             for tslot in mat.texture_slots.values()
-                             if tslot is not None and
-                             tslot.texture.type == 'IMAGE']
-            self._egg_fp.write('%s<Polygon> %d {\n' % (padding, poly.index))
-            for tex_name in texture_names:
-                self._egg_fp.write('%s  <TRef> { %s }\n' % (padding, tex_name))
-            self._egg_fp.write('%s  <MRef> { ' % padding +
-                               '%s }\n' % material_name +
-                               '%s  <VertexRef> { \n' % padding +
-                               '%s    ' % padding
-                               )
-            for loop_index in poly.loop_indices:
-                self._egg_fp.write('%d ' % mesh.loops[loop_index].vertex_index)
-            self._egg_fp.write(
-                '<Ref> { %s_Mesh }\n' % mesh_name +
-                '%s  }\n' % padding +
-                '%s}\n' % padding)
+    @export_stage('vertex_pool')
+    def _write_vertexPool(self, block):
+        self._stats.count('vertices', len(block.co))
+        step_size = self._step_sizes(block)[0]
+        for text, vertices in block.vertex_pool(step_size):
+            self._egg_fp.write(text)
+            if vertices:
+                self._advance(vertices)
+                yield
+
+    @export_stage('polygons')
+    def _write_polygons(self, block):
+        self._stats.count('polygons', len(block.loop_start))
+        step_size = self._step_sizes(block)[1]
+        for text, polygons in block.polygons(step_size):
+            self._egg_fp.write(text)
+            self._advance(polygons)
+            yield
 
     def _write_groups(self, meshes, name):
+        # read every mesh up front, a step each; with a memory limit
+        # each mesh is read when written and released after it. The
+        # armature and the actions are read later on, so a modal export
+        # needs the scene unchanged until it ends.
+        for mesh in meshes:
+            if not self._memory_limit:
+                self._get_vertex_pool(mesh)
+            self._advance(len(mesh.data.vertices))
+            yield
         self._egg_fp.write('<Group> %s {\n' % name)
         indent_level = 2
         padding = indent_level*' '
-        if len(self._human.data.bones) > 0:
+        if len(self._human.data.bones) > 0 and self._lod_levels:
+            # keeps the LOD groups apart inside the character
+            self._egg_fp.write('%s<Dart> { structured }\n' % padding)
+        elif len(self._human.data.bones) > 0:
             self._egg_fp.write('%s<Dart> { 1 }\n' % padding)
         self._egg_fp.write('%s<Group> CharacterRoot {\n' % padding)
-        for mesh in meshes:
-            self._write_mesh_object(mesh, indent_level+2)
+        mesh_indent = indent_level+2
+        if self._lod_levels:
+            mesh_indent += 2
+        self._start_mesh_pool(meshes, mesh_indent)
+        try:
+            for lod in range(self._lod_levels + 1):
+                if self._lod_levels:
+                    self._write_lod_group(name, lod, indent_level+2)
+                for mesh in meshes:
+                    done = (self._work_done + len(mesh.data.vertices) +
+                            len(mesh.data.polygons))
+                    yield from self._write_mesh_object(mesh, mesh_indent,
+                                                       lod)
+                    # reused and parallel blocks skip the progress steps
+                    if not lod:
+                        self._work_done = done
+                    if self._memory_limit:
+                        self._release_mesh(mesh, lod)
+                if self._lod_levels:
+                    self._egg_fp.write('%s  }\n' % padding)
+        finally:
+            self._stop_mesh_pool()
         if len(self._human.data.bones) > 0:
-            self._write_armature(meshes, name, indent_level+2)
+            yield from self._write_armature(meshes, name, indent_level+2)
         self._egg_fp.write(
             '%s}\n' % padding +
             '}\n')
 
+    def _write_lod_group(self, name, lod, indent_level=0):
+        """
+        Open the group of a level of detail. Level n shows from
+        lod_distance * 2**(n-1) up to lod_distance * 2**n, the last
+        level up to any distance.
+        """
+        padding = indent_level*' '
+        switch_out = 0.0
+        if lod:
+            switch_out = self._lod_distance * 2 ** (lod - 1)
+        switch_in = self._lod_distance * 2 ** lod
+        if lod == self._lod_levels:
+            switch_in = 1.0e7
+        self._egg_fp.write('%s<Group> %s_LOD%d {\n' % (padding, name, lod) +
+                           self._formatter.switch_condition(
+                               padding + '  ', switch_in, switch_out))
+
+    def _export_actions(self, human):
+        """
+        The actions to export as animations of a character: none, its
+        current action or every action animating its bones.
+        """
+        if not len(human.data.bones):
+            return []
+        if self._animations == 'ACTIVE':
+            anim_data = human.animation_data
+            if anim_data is not None and anim_data.action is not None:
+                return [anim_data.action]
+        elif self._animations == 'ALL':
+            bone_names = set(human.data.bones.keys())
+            return [action for action in bpy.data.actions
+                    if any(fcurve_bone_name(fcurve.data_path) in bone_names
+                           for fcurve in action.fcurves)]
+        return []
+
+    @staticmethod
+    def _action_frames(action):
+        start, end = action.frame_range
+        return range(int(round(start)), int(round(end)) + 1)
+
+    def _get_skeleton_arrays(self):
+        if self._skeleton_arrays is None:
+            self._skeleton_arrays = SkeletonArrays(self._human.data)
+        return self._skeleton_arrays
+
+    @export_stage('animations')
+    def _write_animations(self, actions):
+        """
+        Sample every frame of the actions and write them as animation
+        bundles. A frame costs one frame_set and one foreach_get of all
+        pose bone matrices, the joint transforms of a chunk of frames
+        are then worked out for all bones at once.
+        """
+        human = self._human
+        scene = bpy.context.scene
+        skeleton = self._get_skeleton_arrays()
+        pose_bones = human.pose.bones
+        # pose bones are matched by name, their order is not guaranteed
+        pose_index = dict((name, i)
+                          for i, name in enumerate(pose_bones.keys()))
+        order = np.array([pose_index[name] for name in skeleton.names])
+        fps = scene.render.fps / scene.render.fps_base
+        frame_current = scene.frame_current
+        anim_data = human.animation_data
+        created = anim_data is None
+        if created:
+            anim_data = human.animation_data_create()
+        action_current = anim_data.action
+        try:
+            for action in actions:
+                anim_data.action = action
+                frames = self._action_frames(action)
+                components = np.empty((len(frames), len(order), 9),
+                                      dtype=np.float32)
+                for start in range(0, len(frames), self._frame_chunk):
+                    chunk = frames[start:start + self._frame_chunk]
+                    pose = np.empty((len(chunk), len(order), 4, 4))
+                    for index, frame in enumerate(chunk):
+                        scene.frame_set(frame)
+                        pose[index] = matrix_array(pose_bones,
+                                                   'matrix')[order]
+                        self._advance(len(order))
+                        yield
+                    with self._stats.stage('joint_transforms'):
+                        components[start:start + len(chunk)] = (
+                            decompose_transforms(
+                                skeleton.joint_transforms(pose)))
+                self._stats.count('animation_frames', len(frames))
+                # no jumps of 360 degrees between frames, for blending
+                components[..., 3:6] = np.degrees(np.unwrap(
+                    np.radians(components[..., 3:6]), axis=0))
+                yield from self._write_anim_bundle(action, components, fps)
+        finally:
+            anim_data.action = action_current
+            if created:
+                human.animation_data_clear()
+            scene.frame_set(frame_current)
+
+    def _write_anim_bundle(self, action, components, fps):
+        """
+        Write the <Bundle> of an action into the model file, or into a
+        file of its own next to it with separate_animations. The table
+        carries the action name, the bundle the character's, so that
+        autoBind only pairs it with its own character.
+        """
+        if self._separate_animations:
+            anim_name = action.name
+            if len(self._humans) > 1:
+                anim_name = '%s_%s' % (self._group_name, anim_name)
+            filepath = suffixed_filepath(self._filepath, anim_name)
+            print('Writing animation %s' % filepath)
+            if self._output_format == 'BAM':
+                sink = BamFileSink(filepath)
+            else:
+                sink = EggFileSink(filepath, self._compress)
+            sink.write('<CoordinateSystem> { Z-Up }\n\n')
+        else:
+            sink = self._egg_fp
+        try:
+            sink.write('<Table> %s {\n' % good_node_name(action.name) +
+                       '  <Bundle> %s {\n' % self._group_name +
+                       '    <Table> "<skeleton>" {\n')
+            roots = [bone
+                     for bone in self._human.data.bones
+                     if bone.parent is None]
+            yield from self._write_anim_joint(sink, roots[0], components,
+                                              fps, 6)
+            sink.write('    }\n' +
+                       '  }\n' +
+                       '}\n')
+            if sink is not self._egg_fp:
+                sink.commit()
+        except BaseException:
+            if sink is not self._egg_fp:
+                sink.abort()
+            raise
+
+    def _write_anim_joint(self, sink, bone, components, fps,
+                          indent_level=0):
+        padding = indent_level*' '
+        column = self._skeleton_arrays.index[bone.name]
+        sink.write('%s<Table> %s {\n' % (padding, good_bone_name(bone.name)) +
+                   self._formatter.anim_table(padding + '  ', fps,
+                                              components[:, column]))
+        yield
+        for child_bone in bone.children:
+            if child_bone.name in self._pruned_joints:
+                continue
+            yield from self._write_anim_joint(sink, child_bone, components,
+                                              fps, indent_level+2)
+        sink.write('%s}\n' % padding)
+
     def _write_bone_translation(self, bone, indent_level=0):
         loc = bone.head_local
         padding = indent_level*' '
         # make relative if we can
         if bone.parent:
             loc = loc - bone.parent.head_local
-        self._egg_fp.write(
-            '%s<Translate> { ' % padding +
-            ' %.5f %.5f %.5f }\n' % (loc.x, loc.y, loc.z))
+        self._egg_fp.write(self._formatter.translate(padding, loc))
+
+    def _groups_work(self, human, meshes):
+        """
+        Progress units of writing the groups of a character: extraction,
+        vertex pools and polygons, and the joints writing about one
+        vertex reference per vertex.
+        """
+        vertices_tot = sum(len(mesh.data.vertices) for mesh in meshes)
+        work = 2*vertices_tot + sum(len(mesh.data.polygons)
+                                    for mesh in meshes)
+        if len(human.data.bones):
+            work += vertices_tot
+        return work
+
+    def _set_character(self, human, meshes):
+        """
+        Make human the character whose groups and animations are
+        written next.
+        """
+        self._human = human
+        self._pruned_joints = set()
+        self._skeleton_arrays = None
+        if len(self._humans) > 1:
+            self._group_name = good_node_name(human.name)
+        bones_tot = len(human.data.bones)
+        if bones_tot:
+            vertices_tot = sum(len(mesh.data.vertices) for mesh in meshes)
+            self._joint_work = float(vertices_tot) / bones_tot
+
+    def _advance(self, work):
+        self._work_done += work
+
+    def progress(self):
+        """
+        Return the done fraction of the running export.
+        """
+        if not self._work_total:
+            return 0.0
+        return min(1.0, float(self._work_done) / self._work_total)
 
     def produce_egg(self):
+        for _ in self.export_steps():
+            pass
+        return self.result
+
+    def export_steps(self):
+        """
+        Export in small steps, yielding the done fraction after each one,
+        so that a modal operator can keep Blender responsive. Closing the
+        generator cancels the export and leaves no output file behind.
+        The result ({'FINISHED'} or {'CANCELLED'}) is stored in
+        self.result.
+        """
+        self.result = {'CANCELLED'}
         bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.context.scene.objects.active = self._human
-        meshes = [child
-                  for child in self._human.children
-                  if child.type == 'MESH']
+        bpy.context.scene.objects.active = self._humans[0]
+        characters = []
+        self._work_done = 0
+        self._work_total = 0
+        for human in self._humans:
+            meshes = [child
+                      for child in human.children
+                      if child.type == 'MESH']
+            actions = self._export_actions(human)
+            # one step per sampled frame and bone
+            self._work_total += (self._groups_work(human, meshes) +
+                                 len(human.data.bones) *
+                                 sum(len(self._action_frames(action))
+                                     for action in actions))
+            characters.append((human, meshes, actions))
+        self._stats.start()
         try:
-            try:
-                self._egg_fp = codecs.open(self._filepath, 'w',
-                                           encoding='utf-8')
+            if self._output_format == 'BAM':
+                # the egg loader's meshing would undo the cache order
+                self._egg_fp = BamFileSink(
+                    self._filepath,
+                    egg_mesh=not self._optimize_vertex_cache)
+                print('Writing Bam file %s' % self._filepath)
+            else:
+                self._egg_fp = EggFileSink(self._filepath, self._compress)
                 print('Writing Egg file %s' % self._filepath)
-            except:
-                self._egg_fp = None
-                print('Unable to open file for writing %s' % self._filepath)
-            blendFilename = bpy.path.basename(bpy.context.blend_data.filepath)
-            eggFilename = self._filename + '.egg'
-            self._egg_fp.write('<CoordinateSystem> { Z-Up }\n\n' +
-                               '<Comment> {\n' +
-                               '"io_export_egg.py %s ' % blendFilename +
-                               '%s"\n' % eggFilename +
-                               '}\n\n')
+        except (IOError, OSError):
+            print('Unable to open file for writing %s' % self._filepath)
+            return
+        steps = self._write_egg(characters)
+        try:
+            for _ in steps:
+                # the export is suspended until the next step is asked for
+                self._stats.pause()
+                yield self.progress()
+                self._stats.resume()
+            with self._stats.stage('texture_copies'):
+                self._texture_cache.wait()
+            with self._stats.stage('commit'):
+                self._egg_fp.commit()
+            if self._block_cache is not None:
+                print('Reused %d of %d cached blocks' %
+                      (self._block_cache.hits,
+                       self._block_cache.hits + self._block_cache.misses))
+                self._block_cache.save()
+        except BaseException:
+            # puts back the file sink when a cached block was recording
+            steps.close()
+            self._egg_fp.abort()
+            raise
+        finally:
+            print('Done.')
+        self._stats.stop()
+        if self._write_report:
+            self._save_report()
+        self.result = {'FINISHED'}
+
+    def _write_egg(self, characters):
+        blendFilename = bpy.path.basename(bpy.context.blend_data.filepath)
+        eggFilename = self._filename + '.egg'
+        self._egg_fp.write('<CoordinateSystem> { Z-Up }\n\n' +
+                           '<Comment> {\n' +
+                           '"io_export_egg.py %s ' % blendFilename +
+                           '%s"\n' % eggFilename +
+                           '}\n\n')
+        all_meshes = [mesh for _, meshes, _ in characters for mesh in meshes]
+        self._open_mesh_pool(len(all_meshes) * (self._lod_levels + 1))
+        try:
             print('Exporting textures')
-            self._write_textures(meshes)
+            self._write_textures(all_meshes)
+            yield
             print('Exporting materials')
-            self._write_materials(meshes)
+            self._write_materials(all_meshes)
+            yield
             print('Exporting geometry & armature')
-            name = self._filename
-            self._write_groups(meshes, name)
+            for human, meshes, actions in characters:
+                self._set_character(human, meshes)
+                done = self._work_done + self._groups_work(human, meshes)
+                yield from self._write_groups(meshes, self._group_name)
+                # reused and parallel blocks skip some progress steps
+                self._work_done = done
+                if actions:
+                    print('Exporting animations')
+                    yield from self._write_animations(actions)
         finally:
-            if self._egg_fp:
-                self._egg_fp.close()
-            print('Done.')
-        return {'FINISHED'}
+            self._close_mesh_pool()
+
+    def report(self):
+        """
+        Return the stage timings and counts of the last export.
+        """
+        report = self._stats.report()
+        report.update({
+            'filepath': self._filepath,
+            'format': self._output_format,
+            'compressed': bool(self._compress),
+            'object': ', '.join(human.name for human in self._humans),
+            'blend': bpy.context.blend_data.filepath,
+            'bytes_written': getattr(self._egg_fp, 'bytes_written', 0),
+        })
+        if self._output_format != 'BAM' or not self._egg_fp:
+            try:
+                report['file_size'] = os.path.getsize(self._filepath)
+            except OSError:
+                pass
+        return report
+
+    def _save_report(self):
+        path = self._filepath + '.report.json'
+        try:
+            with io.open(path, 'w', encoding='utf-8') as fp:
+                fp.write(json.dumps(self.report(), indent=1,
+                                    sort_keys=True))
+            print('Export report %s' % path)
+        except (IOError, OSError):
+            print('Unable to write export report %s' % path)
+
+
+def chained_export_steps(workers):
+    """
+    Run the exports of several workers one after the other in steps,
+    yielding the overall done fraction, and stop at the first one that
+    does not finish. Closing the generator cancels the running export.
+    """
+    for index, worker in enumerate(workers):
+        steps = worker.export_steps()
+        try:
+            for progress in steps:
+                yield (index + progress) / len(workers)
+        finally:
+            steps.close()
+        if worker.result != {'FINISHED'}:
+            return
+
+
+def chained_export_result(workers):
+    for worker in workers:
+        if worker.result != {'FINISHED'}:
+            return worker.result or {'CANCELLED'}
+    return {'FINISHED'}
 
 
 ##########################################
@@ -487,7 +2750,16 @@ class ExportEggOperator(bpy.types.Operator, ExportHelper):
     bl_idname = "export.egg"
     bl_label = "Export to Panda3D egg"
     filename_ext = ".egg"
-    filter_glob = StringProperty(default="*.egg", options={'HIDDEN'})
+    filter_glob = StringProperty(default="*.egg;*.egg.pz;*.bam",
+                                 options={'HIDDEN'})
+    export_format = EnumProperty(items=(
+        ('EGG', "Egg (.egg)", "Panda3D egg text"),
+        ('BAM', "Bam (.bam)", "Panda3D binary bam, needs the panda3d "
+                              "modules in Blender's Python"),
+        ),
+        name="format",
+        description="Output file format",
+        default='EGG')
     vertex_membership_precision = EnumProperty(items=(
         ('4', "4 decimal places", ""),
         ('5', "5 decimal places", ""),
@@ -496,29 +2768,274 @@ class ExportEggOperator(bpy.types.Operator, ExportHelper):
         name="precision to",
         description="Vertex to bone membership precision",
         default='4')
+    vertex_precision = EnumProperty(items=(
+        ('4', "4 decimal places", ""),
+        ('5', "5 decimal places", ""),
+        ('6', "6 decimal places", ""),
+        ),
+        name="vertex precision to",
+        description="Precision of vertex positions, normals and UVs",
+        default='4')
     use_rel_paths = BoolProperty(
         name="use relative paths",
         description="Use relative path",
         default=True,
         )
+    export_selected = BoolProperty(
+        name="all selected characters",
+        description="Export every selected armature, or the armature of "
+                    "every selected mesh, not only the first selected "
+                    "object",
+        default=False,
+        )
+    character_files = BoolProperty(
+        name="one file per character",
+        description="Write every character to its own <file>-<character> "
+                    "file instead of all into one, sharing the textures",
+        default=False,
+        )
+    split_uv_seams = BoolProperty(
+        name="split vertices at UV seams",
+        description="Give a vertex one copy per distinct UV of its faces, "
+                    "otherwise it keeps the UV of its first face",
+        default=True,
+        )
+    max_influences = IntProperty(
+        name="max influences",
+        description="Keep only the largest bone weights of every vertex "
+                    "and rescale them, 0 keeps all",
+        default=0, min=0, max=16,
+        )
+    min_weight = FloatProperty(
+        name="min weight",
+        description="Drop the bone weights below this value, except the "
+                    "largest one of a vertex",
+        default=0.0, min=0.0, max=1.0,
+        )
+    prune_joints = BoolProperty(
+        name="prune unused joints",
+        description="Leave out the joints without any vertex weights in "
+                    "their whole subtree",
+        default=False,
+        )
+    write_weight_comments = BoolProperty(
+        name="weight comments",
+        description="Write the bone weights of every vertex as comments",
+        default=True,
+        )
+    optimize_vertex_cache = BoolProperty(
+        name="optimize for vertex cache",
+        description="Triangulate and reorder the triangles and vertices "
+                    "for the GPU vertex caches; egg files keep the order "
+                    "only when loaded with egg-mesh 0",
+        default=False,
+        )
+    lod_levels = IntProperty(
+        name="levels of detail",
+        description="Number of decimated levels of detail added to every "
+                    "mesh, each with half the vertices of the one before",
+        default=0, min=0, max=6,
+        )
+    lod_distance = FloatProperty(
+        name="LOD distance",
+        description="Camera distance of the first level of detail switch, "
+                    "doubling for every further level",
+        default=10.0, min=0.0,
+        )
+    export_animations = EnumProperty(items=(
+        ('NONE', "None", "Only the model"),
+        ('ACTIVE', "Current action", "The current action of the armature"),
+        ('ALL', "All actions", "Every action animating pose bones"),
+        ),
+        name="animations",
+        description="Actions written as animation tables, sampled at "
+                    "every frame of their range",
+        default='NONE')
+    separate_animations = BoolProperty(
+        name="separate animation files",
+        description="Write every action to its own <model>-<action> file "
+                    "instead of into the model file",
+        default=False,
+        )
+    use_texture_cache = BoolProperty(
+        name="reuse unchanged textures",
+        description="Skip textures already copied from an unchanged "
+                    "source file by a previous export",
+        default=True,
+        )
+    use_incremental = BoolProperty(
+        name="incremental",
+        description="Keep the rendered meshes and joints in a .blocks file "
+                    "next to the output and reuse the unchanged ones",
+        default=False,
+        )
+    write_report = BoolProperty(
+        name="write export report",
+        description="Write stage timings, memory and counts to a "
+                    ".report.json file next to the output",
+        default=False,
+        )
+    use_compression = BoolProperty(
+        name="compress (.egg.pz)",
+        description="Write a zlib compressed .egg.pz file",
+        default=False,
+        )
+    use_processes = BoolProperty(
+        name="format meshes in parallel",
+        description="Render the meshes in one forked process per CPU "
+                    "core; only available on Linux",
+        default=False,
+        )
+    memory_limit = IntProperty(
+        name="memory limit (MiB)",
+        description="Bound the text held in memory while exporting, by "
+                    "writing smaller steps and releasing every mesh and "
+                    "level of detail once written; the arrays of the mesh "
+                    "being written still grow with it. 0 for no bound",
+        default=0, min=0,
+        )
+    use_modal = BoolProperty(
+        name="export in background",
+        description="Keep Blender responsive and show the progress while "
+                    "exporting, Esc cancels the export; leave the scene "
+                    "unchanged until it ends. On when exporting from the "
+                    "file browser",
+        default=False,
+        )
+
+    _workers = None
+    _steps = None
+    _timer = None
 
     def draw(self, context):
         layout = self.layout
         box = layout.box()
         box.label('Options:')
+        box.prop(self, 'export_format')
         box.prop(self, 'vertex_membership_precision')
+        box.prop(self, 'vertex_precision')
         box.prop(self, 'use_rel_paths')
+        box.prop(self, 'export_selected')
+        box.prop(self, 'character_files')
+        box.prop(self, 'split_uv_seams')
+        box.prop(self, 'max_influences')
+        box.prop(self, 'min_weight')
+        box.prop(self, 'prune_joints')
+        box.prop(self, 'write_weight_comments')
+        box.prop(self, 'optimize_vertex_cache')
+        box.prop(self, 'lod_levels')
+        box.prop(self, 'lod_distance')
+        box.prop(self, 'export_animations')
+        box.prop(self, 'separate_animations')
+        box.prop(self, 'use_texture_cache')
+        box.prop(self, 'use_incremental')
+        box.prop(self, 'use_compression')
+        box.prop(self, 'write_report')
+        box.prop(self, 'use_processes')
+        box.prop(self, 'memory_limit')
+        box.prop(self, 'use_modal')
 
     @classmethod
     def poll(cls, context):
         selected = context.selected_objects
         return selected
 
+    def invoke(self, context, event):
+        # only the file browser exports in background by default, an
+        # operator call from a script returns with the file written
+        if not self.properties.is_property_set('use_modal'):
+            self.use_modal = True
+        return ExportHelper.invoke(self, context, event)
+
     def execute(self, context):
-        human = context.selected_objects[0]
-        eggWorker = ExportEggWorker(human, self.vertex_membership_precision,
-                                    self.filepath, self.use_rel_paths)
-        return eggWorker.produce_egg()
+        humans = [context.selected_objects[0]]
+        if self.export_selected:
+            humans = selected_characters(context.selected_objects) or humans
+        if self.export_format == 'BAM' and EggData is None:
+            self.report({'ERROR'}, 'Bam export needs the panda3d '
+                                   'modules in Blender\'s Python')
+            return {'CANCELLED'}
+        filepath = export_filepath(self.filepath, self.export_format,
+                                   self.use_compression)
+        # the files of several characters share materials and textures
+        texture_cache = TextureCache(self.use_texture_cache)
+        material_index = MaterialIndex()
+        if self.character_files and len(humans) > 1:
+            workers = [self._worker(human,
+                                    suffixed_filepath(filepath, human.name),
+                                    texture_cache, material_index)
+                       for human in humans]
+        else:
+            workers = [self._worker(humans, filepath, texture_cache,
+                                    material_index)]
+        if not self.use_modal or bpy.app.background:
+            for worker in workers:
+                worker.produce_egg()
+            return chained_export_result(workers)
+        self._workers = workers
+        self._steps = chained_export_steps(workers)
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self._timer = wm.event_timer_add(0.05, context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def _worker(self, human, filepath, texture_cache, material_index):
+        return ExportEggWorker(
+            human, self.vertex_membership_precision, filepath,
+            self.use_rel_paths, vertex_precision=self.vertex_precision,
+            compress=self.use_compression, output_format=self.export_format,
+            texture_cache=texture_cache, material_index=material_index,
+            incremental=self.use_incremental, report=self.write_report,
+            processes=mesh_processes(self.use_processes),
+            split_seams=self.split_uv_seams,
+            max_influences=self.max_influences, min_weight=self.min_weight,
+            prune_joints=self.prune_joints,
+            weight_comments=self.write_weight_comments,
+            optimize_vertex_cache=self.optimize_vertex_cache,
+            lod_levels=self.lod_levels, lod_distance=self.lod_distance,
+            animations=self.export_animations,
+            separate_animations=self.separate_animations,
+            memory_limit=self.memory_limit)
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.cancel(context)
+            self.report({'WARNING'}, 'Export cancelled')
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        # run steps for a short slice of time, then let Blender redraw
+        deadline = time.perf_counter() + 0.1
+        try:
+            progress = next(self._steps)
+            while time.perf_counter() < deadline:
+                progress = next(self._steps)
+        except StopIteration:
+            self._end_modal(context)
+            result = chained_export_result(self._workers)
+            if result != {'FINISHED'}:
+                self.report({'ERROR'}, 'Unable to open file for writing')
+            return result
+        except Exception as e:
+            self._end_modal(context)
+            self.report({'ERROR'}, 'Export failed: %s' % e)
+            return {'CANCELLED'}
+        context.window_manager.progress_update(int(progress * 100))
+        return {'PASS_THROUGH'}
+
+    def cancel(self, context):
+        if self._steps is not None:
+            self._steps.close()
+        self._end_modal(context)
+
+    def _end_modal(self, context):
+        self._steps = None
+        wm = context.window_manager
+        if self._timer is not None:
+            wm.event_timer_remove(self._timer)
+            self._timer = None
+            wm.progress_end()
 
 
 def menu_func(self, context):
@@ -535,5 +3052,168 @@ def unregister():
     bpy.types.INFO_MT_file_export.remove(menu_func)
 
 
+##########################################
+# Batch export
+##########################################
+
+# Options of a batch job, named and defaulted like ExportEggOperator's
+BATCH_DEFAULTS = {
+    'export_format': 'EGG',
+    'vertex_membership_precision': '4',
+    'vertex_precision': '4',
+    'use_rel_paths': True,
+    'split_uv_seams': True,
+    'max_influences': 0,
+    'min_weight': 0.0,
+    'prune_joints': False,
+    'write_weight_comments': True,
+    'optimize_vertex_cache': False,
+    'lod_levels': 0,
+    'lod_distance': 10.0,
+    'export_animations': 'NONE',
+    'separate_animations': False,
+    'use_texture_cache': True,
+    'use_compression': False,
+    'use_incremental': False,
+    'use_processes': False,
+    'memory_limit': 0,
+    'write_report': False,
+    'track_memory': False,
+}
+
+# Keys of a batch job besides its options
+BATCH_JOB_KEYS = ('blend', 'object', 'filepath')
+
+
+def _check_batch_keys(entry, known, what):
+    unknown = sorted(set(entry) - set(known))
+    if unknown:
+        raise ValueError('unknown %s: %s' % (what, ', '.join(unknown)))
+
+
+def _batch_armatures(name):
+    if isinstance(name, list):
+        return [bpy.data.objects[object_name] for object_name in name]
+    if name:
+        return [bpy.data.objects[name]]
+    armatures = [obj for obj in bpy.data.objects if obj.type == 'ARMATURE']
+    if len(armatures) != 1:
+        raise ValueError('job needs an "object" name, found %d armatures'
+                         % len(armatures))
+    return armatures
+
+
+def batch_export(manifest_path):
+    """
+    Export every job of a JSON manifest in this Blender session:
+
+    {"defaults": {"use_compression": true},
+     "report": "batch_report.json",
+     "jobs": [{"blend": "human1.blend", "object": "human1",
+               "filepath": "out/human1.egg"}, ...]}
+
+    Job and default options are named like the ExportEggOperator
+    properties; an unknown manifest or default key stops the batch, an
+    unknown job key fails that job. An "object" list exports those
+    characters into one egg. "blend" is opened only when it differs from the
+    currently loaded file, so variants living in one .blend are
+    exported back to back. Copied textures are shared by all jobs and
+    the material index by all jobs of one .blend. Relative paths are
+    taken from the manifest's folder. Returns the per job report.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with io.open(manifest_path, 'r', encoding='utf-8') as fp:
+        manifest = json.load(fp)
+    _check_batch_keys(manifest, ('defaults', 'report', 'jobs'),
+                      'manifest keys')
+    if 'jobs' not in manifest:
+        raise ValueError('manifest has no "jobs" list')
+    _check_batch_keys(manifest.get('defaults', {}), BATCH_DEFAULTS,
+                      'default options')
+    defaults = dict(BATCH_DEFAULTS)
+    defaults.update(manifest.get('defaults', {}))
+    texture_caches = {}
+    material_index = MaterialIndex()
+    report = []
+    for job_index, job in enumerate(manifest['jobs']):
+        options = dict(defaults)
+        options.update(job)
+        result = {'job': job_index, 'filepath': None, 'status': 'FAILED'}
+        report.append(result)
+        start = time.time()
+        try:
+            _check_batch_keys(job, BATCH_JOB_KEYS + tuple(BATCH_DEFAULTS),
+                              'job options')
+            blend = options.get('blend')
+            if blend:
+                blend = os.path.join(base, blend)
+                if (os.path.abspath(bpy.data.filepath) !=
+                        os.path.abspath(blend)):
+                    bpy.ops.wm.open_mainfile(filepath=blend)
+                    material_index = MaterialIndex()
+            humans = _batch_armatures(options.get('object'))
+            filepath = export_filepath(os.path.join(base,
+                                                    options['filepath']),
+                                       options['export_format'],
+                                       options['use_compression'])
+            result['object'] = ', '.join(human.name for human in humans)
+            result['filepath'] = filepath
+            use_texture_cache = bool(options['use_texture_cache'])
+            if use_texture_cache not in texture_caches:
+                texture_caches[use_texture_cache] = TextureCache(
+                    use_texture_cache)
+            eggWorker = ExportEggWorker(
+                humans, options['vertex_membership_precision'], filepath,
+                options['use_rel_paths'],
+                vertex_precision=options['vertex_precision'],
+                compress=options['use_compression'],
+                output_format=options['export_format'],
+                texture_cache=texture_caches[use_texture_cache],
+                material_index=material_index,
+                incremental=options['use_incremental'],
+                report=options['write_report'],
+                track_memory=options['track_memory'],
+                processes=mesh_processes(options['use_processes']),
+                split_seams=options['split_uv_seams'],
+                max_influences=options['max_influences'],
+                min_weight=options['min_weight'],
+                prune_joints=options['prune_joints'],
+                weight_comments=options['write_weight_comments'],
+                optimize_vertex_cache=options['optimize_vertex_cache'],
+                lod_levels=options['lod_levels'],
+                lod_distance=options['lod_distance'],
+                animations=options['export_animations'],
+                separate_animations=options['separate_animations'],
+                memory_limit=options['memory_limit'])
+            if 'FINISHED' in eggWorker.produce_egg():
+                result['status'] = 'FINISHED'
+                export_report = eggWorker.report()
+                result['stages'] = export_report['stages']
+                result['counts'] = export_report['counts']
+            else:
+                result['status'] = 'CANCELLED'
+        except Exception as e:
+            result['error'] = '%s: %s' % (type(e).__name__, e)
+            print('Job %d failed: %s' % (job_index, result['error']))
+        result['seconds'] = round(time.time() - start, 3)
+        print('Job %d %s %.3fs %s' % (job_index, result['status'],
+                                      result['seconds'], result['filepath']))
+    total = sum(result['seconds'] for result in report)
+    print('Batch: %d jobs, %d failed, %.3fs' %
+          (len(report),
+           len([r for r in report if r['status'] != 'FINISHED']), total))
+    if manifest.get('report'):
+        with io.open(os.path.join(base, manifest['report']), 'w',
+                     encoding='utf-8') as fp:
+            fp.write(json.dumps(report, indent=1, sort_keys=True))
+    return report
+
+
 if __name__ == "__main__":
-    register()
+    # blender -b -P io_export_egg.py -- manifest.json
+    if '--' in sys.argv and sys.argv[sys.argv.index('--') + 1:]:
+        batch_report = batch_export(sys.argv[sys.argv.index('--') + 1])
+        if any(result['status'] != 'FINISHED' for result in batch_report):
+            sys.exit(1)
+    else:
+        register()